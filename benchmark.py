@@ -0,0 +1,186 @@
+"""
+Benchmarks of the solver on seeded random labyrinths.
+
+For every size, fill ratio and search method the compilation of the
+configuration graph and the search itself are timed separately, and the
+number of expanded states and the peak memory (as seen by tracemalloc)
+are recorded. The results are written to a JSON or CSV file, and can be
+compared against the results of a previous run:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --output new.json --baseline baseline.json
+"""
+import argparse
+import csv
+import json
+import time
+import tracemalloc
+
+from functions import *
+
+DEFAULT_SIZES = [(9,5), (50,50), (100,100), (250,250), (500,500), (1000,1000), (2000,2000)]
+DEFAULT_FILLS = [0.0, 0.02, 0.05, 0.1] # the rod gets stuck quickly beyond
+DEFAULT_METHODS = ['bfs', 'astar', 'bidirectional', 'bitboard']
+KEY_FIELDS = ['lx', 'ly', 'fill', 'method', 'seed']
+
+def benchmark_lab(lx, ly, fill, seed):
+    """
+    Gives a random labyrinth of the benchmarks: the corners of the default
+    source rod and target are cleared (as much as a rotation needs), so that
+    the rod is not stuck from the start.
+    """
+    occupancy = random_grid(lx, ly, fill, seed)
+    l = 2*RADIUS + 1
+    occupancy[:l, :l] = False
+    occupancy[-l:, -l:] = False
+    return occupancy
+
+def _best_time(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def _peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_case(lx, ly, fill, method, seed = 0, repeat = 3):
+    """
+    Benchmarks one labyrinth and one method.
+
+    Output:
+        - a dictionary with the parameters of the case, the best times of
+            the compilation and of the search (in seconds), the distance,
+            the number of states of the graph, the expanded states and the
+            peak memory of compilation and search (in bytes)
+    """
+    lab = benchmark_lab(lx, ly, fill, seed)
+    source = (RADIUS, 0, 0)
+
+    compile_time, graph = _best_time(lambda: compile_lab(lab, use_cache = False), repeat)
+    compile_memory = _peak_memory(lambda: compile_lab(lab, use_cache = False))
+
+    def solve():
+        LAB_CACHE.clear()
+        LAB_CACHE.get(lab_key(lab), lambda: graph) # the search starts compiled
+        return solution(lab, source = source, method = method)
+
+    solve_time, distance = _best_time(solve, repeat)
+    solve_memory = _peak_memory(solve)
+    stats = {}
+    solve_with_stats = solution(lab, source = source, method = method, stats = stats)
+    assert solve_with_stats == distance
+
+    return {'lx': lx, 'ly': ly, 'fill': fill, 'method': method, 'seed': seed,
+            'distance': distance, 'states': len(graph),
+            'expanded': stats.get('expanded', 0),
+            'compile_time': compile_time, 'solve_time': solve_time,
+            'compile_memory': compile_memory, 'solve_memory': solve_memory}
+
+def run_suite(sizes = DEFAULT_SIZES, fills = DEFAULT_FILLS, methods = DEFAULT_METHODS,
+              seed = 0, repeat = 3, verbose = True):
+    """ Benchmarks every combination of size, fill and method """
+    results = []
+    for lx, ly in sizes:
+        for fill in fills:
+            for method in methods:
+                result = run_case(lx, ly, fill, method, seed = seed, repeat = repeat)
+                if verbose:
+                    print(f"{lx:>5} x {ly:<5} fill {fill:.2f} {method:<14}"
+                          f" compile {result['compile_time']:9.4f} s"
+                          f" solve {result['solve_time']:9.4f} s"
+                          f" expanded {result['expanded']:>9}"
+                          f" peak {max(result['compile_memory'], result['solve_memory']) / 2**20:8.1f} MiB")
+                results.append(result)
+    return results
+
+def save_results(results, path):
+    """ Writes the results to a JSON file, or a CSV file if path ends in .csv """
+    with open(path, 'w', newline = '') as f:
+        if path.endswith('.csv'):
+            writer = csv.DictWriter(f, fieldnames = list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            json.dump(results, f, indent = 1)
+
+def load_results(path):
+    """ Reads the results written by save_results( ) """
+    with open(path, newline = '') as f:
+        if not path.endswith('.csv'):
+            return json.load(f)
+        results = []
+        for row in csv.DictReader(f):
+            for field in row:
+                if field != 'method':
+                    number = float(row[field])
+                    row[field] = int(number) if number.is_integer() and field != 'fill' else number
+            results.append(row)
+        return results
+
+def compare(results, baseline, tolerance = 0.2, minimum = 1e-3):
+    """
+    Compares the results with a baseline, case by case.
+
+    Inputs:
+        - results, baseline: lists of results of run_case( )
+        - tolerance (optional): the relative slowdown reported as a regression
+        - minimum (optional): times below this (in seconds) are not compared,
+            they are mostly noise
+    Output:
+        - a list of (case, field, baseline value, new value) of the regressions:
+            slower times, or more expanded states, or a different distance
+    """
+    reference = {tuple(r[k] for k in KEY_FIELDS): r for r in baseline}
+    regressions = []
+    for result in results:
+        case = tuple(result[k] for k in KEY_FIELDS)
+        if case not in reference:
+            continue
+        old = reference[case]
+        if result['distance'] != old['distance']:
+            regressions.append((case, 'distance', old['distance'], result['distance']))
+        if result['expanded'] > old['expanded']:
+            regressions.append((case, 'expanded', old['expanded'], result['expanded']))
+        for field in ['compile_time', 'solve_time']:
+            if max(result[field], old[field]) < minimum:
+                continue
+            if result[field] > (1 + tolerance)*old[field]:
+                regressions.append((case, field, old[field], result[field]))
+    return regressions
+
+def _sizes(text):
+    return [tuple(int(n) for n in size.split('x')) for size in text.split(',')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Benchmarks of the rod pathfinding solver.")
+    parser.add_argument('--sizes', type = _sizes, default = DEFAULT_SIZES,
+                        help = "comma separated sizes, e.g. 9x5,100x100")
+    parser.add_argument('--fills', type = lambda t: [float(f) for f in t.split(',')],
+                        default = DEFAULT_FILLS)
+    parser.add_argument('--methods', type = lambda t: t.split(','), default = DEFAULT_METHODS)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--output', default = 'bench_results.json')
+    parser.add_argument('--baseline', help = "results of a previous run to compare with")
+    parser.add_argument('--tolerance', type = float, default = 0.2)
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes, args.fills, args.methods, args.seed, args.repeat)
+    save_results(results, args.output)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, load_results(args.baseline), args.tolerance)
+        for case, field, old, new in regressions:
+            print(f"REGRESSION {case}: {field} {old} -> {new}")
+        if regressions:
+            raise SystemExit(1)
+        print("No regressions with respect to the baseline.")
@@ -1,6 +1,14 @@
 import numpy as np
 import random
 import copy
+import heapq
+import hashlib
+import os
+import sqlite3
+import struct
+import time
+from collections import deque, OrderedDict, namedtuple, Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 RADIUS = 1 # how long the arm of the rod extends from the center.
 
@@ -54,10 +62,10 @@ def get_xs_ys(rod):
 
     # generate all the points to check
     if o: # if rod  is vertical
-        ys = [y - RADIUS, y, y + RADIUS]
+        ys = [y + d for d in range(-RADIUS, RADIUS + 1)]
         xs = l*[x]
     else: # if rod is horizontal
-        xs = [x - RADIUS, x, x + RADIUS]
+        xs = [x + d for d in range(-RADIUS, RADIUS + 1)]
         ys = l*[y]
     return xs,ys
 
@@ -112,6 +120,15 @@ def get_shape(lab):
     viable rows.
     """
 
+    if isinstance(lab, Labyrinth): # validated when it was created
+        return lab.lx, lab.ly
+
+    if isinstance(lab, np.ndarray): # arrays have rows of equal length
+        if lab.ndim != 2 or lab.size == 0:
+            raise ValueError("Invalid labyrinth!")
+        len_y, len_x = lab.shape
+        return len_x, len_y
+
     len_y = len(lab)
 
     if len_y == 0:
@@ -124,30 +141,27 @@ def get_shape(lab):
             raise ValueError("Invalid labyrinth!")
     return len_x, len_y
 
-def str2lab(string):
+def str2lab(string, lx = 9):
     """
     This function creates an immutable object encoding
-    the labyrinth, namely a list of lists. It assumes that
-    the labyrinth is of fixed 5 x 9 size. 
+    the labyrinth, namely a list of lists. The string is
+    cut in rows of lx characters (9 by default, the width
+    of the labyrinths of the challenge).
 
     It is written for convenience of testing.
 
     Inputs:
-        - string: a string of length 45 encoding where the 
+        - string: a string of length a multiple of lx encoding where the
             obstacles are. '.' means air, '#' means obstacle.
+        - lx (optional): the width of the labyrinth
     Outputs:
         - lab: a list of lists encoding the labyrinth
     """
 
-    if len(string) % 9 != 0:
-        raise ValueError("Not a valid labyrinth of 5 x 9")
+    if len(string) % lx != 0:
+        raise ValueError(f"Not a valid labyrinth of width {lx}")
 
-    if len(string) == 9:
-        return [list(string)]
-
-    else:
-        row = string[:9]
-        return [list(row)] + str2lab(string[9:])
+    return [list(string[k:k + lx]) for k in range(0, len(string), lx)]
 
 def put_obstacles(lab, list_of_obstacles):
     """
@@ -158,16 +172,22 @@ def put_obstacles(lab, list_of_obstacles):
     instead of simply modifying the existing one in memory
 
     Inputs:
-        - lab: a list of 5 lists, each of length 9
+        - lab: a list of lists (or an occupancy array)
         - list_of_obstacles: a list of tuples containing the
             indices of where to put an obstacle
     Output:
-        - new_lab: a list of 5 lists, each of length 9
+        - new_lab: a list of lists (resp. an occupancy array)
     """
 
     # this seems to be modifying the labyrinth in place
     # unless I make a specific copy
 
+    if isinstance(lab, (np.ndarray, Labyrinth)):
+        new_lab = lab2array(lab).copy()
+        for i,j in list_of_obstacles:
+            new_lab[j, i] = True
+        return Labyrinth(new_lab) if isinstance(lab, Labyrinth) else new_lab
+
     new_lab = copy.deepcopy(lab)
     for i,j in list_of_obstacles:
         new_lab[j][i]='#'
@@ -184,8 +204,7 @@ def random_lab(lx = 9, ly = 5, fill = 0.2):
     Output:
         - list of list of strings, the labyrinth generated
     """
-    lab_base = str2lab(5*'.........')
-    new_lab = copy.deepcopy(lab_base)
+    new_lab = [lx*['.'] for j in range(ly)]
     for i in range(lx):
         for j in range(ly):
             if random.random() <= fill:
@@ -193,6 +212,413 @@ def random_lab(lx = 9, ly = 5, fill = 0.2):
     return new_lab
 
  
+def random_grid(lx = 9, ly = 5, fill = 0.2, seed = None):
+    """
+    This function generates the occupancy array of a random labyrinth,
+    drawing all the cells at once; it is reproducible given the seed.
+
+    Optional inputs:
+        - lx, ly: positive integers, size of the labyrinth
+        - fill: float between 0 and 1, probability of a cell being a block
+        - seed: an integer seed, or a numpy random Generator
+    Output:
+        - a boolean numpy array of shape (ly, lx), True where there is a block
+    """
+    rng = np.random.default_rng(seed)
+    return rng.random((ly, lx)) < fill
+
+# OCCUPANCY GRID AND VALIDITY MASKS
+
+    # The labyrinth is converted once into a boolean numpy array (True for a
+    # solid block, indexed as [y, x]), and the validity of every rod state is
+    # computed at once instead of cell by cell: with a summed-area table of
+    # the blocks, the number of blocks in any window is given by 4 entries.
+
+def lab2array(lab):
+    """
+    This function converts the labyrinth into a boolean occupancy array.
+
+    Inputs:
+        - lab: the list of lists encoding the labyrinth, or a numpy array
+            (of characters, or of booleans/integers with nonzero for a block)
+    Output:
+        - a boolean numpy array of shape (ly, lx), True where there is a block
+    """
+    if isinstance(lab, Labyrinth):
+        return lab.grid
+    if isinstance(lab, np.ndarray):
+        if lab.dtype == bool:
+            return lab
+        if lab.dtype.kind in 'US':
+            return lab == '#'
+        return lab != 0
+    get_shape(lab) # validates the rows
+    return np.array(lab, dtype = 'U1') == '#'
+
+def summed_area_table(occupancy):
+    """
+    Gives the summed-area table of the blocks: an array with one more row and
+    column than occupancy (only the last two axes, y and x, are summed), the
+    entry [y, x] being the number of blocks in the cells above and to the
+    left of (x,y), that is in the rows 0, ..., y-1 and columns 0, ..., x-1.
+    """
+    *batch, ly, lx = occupancy.shape
+    table = np.zeros((*batch, ly + 1, lx + 1), dtype = np.int32)
+    table[..., 1:, 1:] = occupancy.cumsum(axis = -2, dtype = np.int32).cumsum(axis = -1)
+    return table
+
+def _window_free(table, wy, wx):
+    """
+    Gives, from a summed-area table, a boolean array of the shape of the
+    labyrinth which is True at (y,x) when the wy x wx window centered at
+    (y,x) lies within the box and is entirely free.
+    """
+    ly, lx = table.shape[-2] - 1, table.shape[-1] - 1
+    out = np.zeros(table.shape[:-2] + (ly, lx), dtype = bool)
+    if wy > ly or wx > lx: # the window never fits
+        return out
+    blocks = (table[..., wy:, wx:] - table[..., :-wy, wx:]
+              - table[..., wy:, :-wx] + table[..., :-wy, :-wx])
+    ry, rx = wy // 2, wx // 2
+    out[..., ry:ly - ry, rx:lx - rx] = (blocks == 0)
+    return out
+
+def rod_masks(lab):
+    """
+    This function computes the validity masks of the rod in the labyrinth.
+
+    Inputs:
+        - lab: the list of lists encoding the labyrinth (or its occupancy
+            array, or a stack of occupancy arrays of shape (N, ly, lx))
+    Output:
+        - hor, ver, rot: boolean arrays of shape (ly, lx), True at (y,x) when
+            a horizontal rod, resp. a vertical rod, centered at (x,y) sits in
+            the box without collision, resp. when a rod centered there can
+            rotate (of shape (N, ly, lx) for a stack)
+    """
+    if isinstance(lab, Labyrinth):
+        table = lab.table
+    else:
+        table = summed_area_table(lab2array(lab))
+    l = 2*RADIUS + 1 # the total length of the rod
+
+    hor = _window_free(table, 1, l)
+    ver = _window_free(table, l, 1)
+    rot = _window_free(table, l, l) # the L x L box of air needed to rotate
+    return hor, ver, rot
+
+# RIGID PIECES
+
+    # Other rigid pieces than the rod can be moved in the labyrinth. A piece
+    # lists the cells it covers in each of its orientations, as offsets
+    # (dx,dy) from its center, and for each rotation the cells which must be
+    # free while it turns (its sweep region). Rotating clockwise (move 'r')
+    # maps the offset (dx,dy) to (-dy,dx), and counterclockwise (move 'l')
+    # goes back; a piece with two orientations, as the rod, only turns with
+    # 'r'. The validity of every placement is computed over the whole grid
+    # at once, one mask per orientation and per rotation, with the
+    # summed-area table when the cells form a rectangle.
+
+def _turn(cells):
+    return tuple(sorted((-dy, dx) for dx, dy in cells))
+
+class Piece:
+    """
+    A rigid piece moved in the labyrinth instead of the rod.
+
+    Inputs:
+        - cells: the offsets (dx,dy) from the center of the cells covered by
+            the piece in its orientation 0; the other orientations are its
+            clockwise quarter turns, as many as are distinct (1, 2 or 4)
+        - sweeps (optional): a dictionary mapping a rotation (o, move), move
+            being 'r' or 'l', to the offsets of the cells which must be free
+            to make it from the orientation o; by default the smallest square
+            around the center containing the piece in all its orientations.
+            A rotation and its reverse must have the same sweep region, as
+            the backward searches rely on the moves being reversible
+        - name (optional): the name of the piece
+    Attributes:
+        - footprints: a tuple with the offsets of every orientation
+        - turns: a tuple of (move, step) of the rotations, the orientation o
+            becoming (o + step) modulo the number of orientations
+        - sweeps: the offsets of the sweep region of every rotation (o, move)
+    """
+
+    def __init__(self, cells, sweeps = None, name = 'piece'):
+        self.name = name
+        footprints = [tuple(sorted(set((int(dx), int(dy)) for dx, dy in cells)))]
+        while len(footprints) < 4 and _turn(footprints[-1]) != footprints[0]:
+            footprints.append(_turn(footprints[-1]))
+        self.footprints = tuple(footprints)
+        n = len(footprints)
+        self.turns = () if n == 1 else (('r', 1),) if n == 2 else (('r', 1), ('l', -1))
+
+        radius = max(max(abs(dx), abs(dy)) for cells in footprints for dx, dy in cells)
+        box = tuple((dx, dy) for dy in range(-radius, radius + 1)
+                             for dx in range(-radius, radius + 1))
+        self.sweeps = {(o, move): box for o in range(n) for move, _ in self.turns}
+        for turn, cells in (sweeps or {}).items():
+            if turn not in self.sweeps:
+                raise ValueError(f"The piece {name!r} has no rotation {turn}.")
+            self.sweeps[turn] = tuple(sorted(set(cells)))
+        for (o, move), cells in self.sweeps.items():
+            back = ((o + 1) % n, 'r') if n == 2 else \
+                   ((o + 1) % n, 'l') if move == 'r' else ((o - 1) % n, 'r')
+            if self.sweeps[back] != cells:
+                raise ValueError(f"The rotations {(o, move)} and {back} of the piece {name!r}"
+                                 " must have the same sweep region.")
+
+    def __len__(self):
+        return len(self.footprints)
+
+    @property
+    def key(self):
+        """ A hashable description of the piece, with which it is cached """
+        return (self.footprints, tuple(sorted(self.sweeps.items())))
+
+    def __eq__(self, other):
+        return isinstance(other, Piece) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"Piece({self.name!r}, {len(self.footprints[0])} cells, {len(self)} orientations)"
+
+    def cells(self, state):
+        """ Gives the list of the cells (x,y) covered by the piece in the state (x,y,o) """
+        x, y, o = state
+        return [(x + dx, y + dy) for dx, dy in self.footprints[o]]
+
+def rod_piece(radius = None):
+    """ Gives the rod of arm radius (RADIUS by default) as a Piece """
+    radius = RADIUS if radius is None else radius
+    return Piece([(d, 0) for d in range(-radius, radius + 1)], name = 'rod')
+
+def polyomino(rows, center = None, name = 'polyomino'):
+    """
+    Gives the Piece drawn with '#' in a list of strings, e.g. ['#.', '#.', '##']
+    for an L, the cell center = (x,y) of the drawing being the center of the
+    piece (the middle of the drawing by default).
+    """
+    if center is None:
+        center = (max(len(row) for row in rows) // 2, len(rows) // 2)
+    cx, cy = center
+    cells = [(x - cx, y - cy) for y, row in enumerate(rows)
+             for x, char in enumerate(row) if char == '#']
+    return Piece(cells, name = name)
+
+L_PIECE = polyomino(['#.', '#.', '##'], center = (0, 1), name = 'L')
+T_PIECE = polyomino(['###', '.#.'], center = (1, 0), name = 'T')
+
+def _offsets_free(table, offsets):
+    """
+    Gives, from a summed-area table, a boolean array of the shape of the
+    labyrinth which is True at (y,x) when all the cells (x+dx, y+dy) for
+    (dx,dy) in offsets are in the box and free.
+    """
+    ly, lx = table.shape[-2] - 1, table.shape[-1] - 1
+    dxs, dys = zip(*offsets)
+    x0, x1, y0, y1 = min(dxs), max(dxs), min(dys), max(dys)
+    out = np.zeros(table.shape[:-2] + (ly, lx), dtype = bool)
+    if x1 - x0 >= lx or y1 - y0 >= ly: # the piece never fits
+        return out
+    cy = slice(-y0, ly - y1) # the centers for which the cells are in the box
+    cx = slice(-x0, lx - x1)
+    h, w = y1 - y0 + 1, x1 - x0 + 1
+    if len(set(offsets)) == h*w: # a rectangle, 4 entries of the table
+        out[..., cy, cx] = (table[..., h:, w:] - table[..., :-h, w:]
+                            - table[..., h:, :-w] + table[..., :-h, :-w]) == 0
+        return out
+    blocks = np.diff(np.diff(table, axis = -1), axis = -2) # back to the occupancy
+    free = np.ones(out[..., cy, cx].shape, dtype = bool)
+    for dx, dy in set(offsets):
+        free &= blocks[..., dy - y0:ly - y1 + dy, dx - x0:lx - x1 + dx] == 0
+    out[..., cy, cx] = free
+    return out
+
+def piece_masks(lab, piece):
+    """
+    This function computes the validity masks of a piece in the labyrinth.
+
+    Inputs:
+        - lab: the list of lists encoding the labyrinth (or its occupancy array)
+        - piece: a Piece
+    Output:
+        - valid: a boolean array of shape (n, ly, lx), n being the number of
+            orientations, True at [o, y, x] when the piece at (x,y,o) sits in
+            the box without collision
+        - turns: a dictionary mapping every rotation move to a boolean array
+            of shape (n, ly, lx), True at [o, y, x] when the sweep region of
+            the rotation from (x,y,o) is in the box and free
+    """
+    table = lab.table if isinstance(lab, Labyrinth) else summed_area_table(lab2array(lab))
+    valid = np.stack([_offsets_free(table, cells) for cells in piece.footprints])
+    turns = {move: np.stack([_offsets_free(table, piece.sweeps[o, move])
+                             for o in range(len(piece))])
+             for move, _ in piece.turns}
+    return valid, turns
+
+# IMMUTABLE LABYRINTH
+
+class Labyrinth:
+    """
+    A labyrinth validated once and never modified, which can be passed to
+    every function in place of the list of lists. It keeps its dimensions,
+    its occupancy grid and the summed-area table of its blocks, with which
+    the question "is this rectangle free?" is answered in constant time,
+    whatever its size: the footprint of the rod and its rotation box alike.
+
+    Input:
+        - lab: the list of lists encoding the labyrinth (or its occupancy array)
+    """
+    __slots__ = ('lx', 'ly', 'grid', 'table', '_key')
+
+    def __init__(self, lab):
+        grid = lab2array(lab)
+        lx, ly = get_shape(grid)
+        if grid.flags.writeable: # a private copy, unless it is read only already
+            grid = grid.copy()
+            grid.setflags(write = False)
+        table = summed_area_table(grid)
+        table.setflags(write = False)
+        for name, value in [('lx', lx), ('ly', ly), ('grid', grid),
+                            ('table', table), ('_key', None)]:
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Labyrinth objects are immutable.")
+
+    def __len__(self):
+        return self.ly
+
+    def __getitem__(self, y):
+        return self.grid[y]
+
+    def __repr__(self):
+        return f"Labyrinth({self.lx} x {self.ly}, {self.blocks(0, 0, self.lx, self.ly)} blocks)"
+
+    @property
+    def key(self):
+        """ The key of the labyrinth in the caches, see lab_key( ) """
+        if self._key is None:
+            object.__setattr__(self, '_key', lab_key(self.grid))
+        return self._key
+
+    def __eq__(self, other):
+        return isinstance(other, Labyrinth) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def blocks(self, x, y, w, h):
+        """ Gives the number of blocks in the w x h rectangle of top left cell (x,y) """
+        t = self.table
+        return int(t[y + h, x + w] - t[y, x + w] - t[y + h, x] + t[y, x])
+
+    def rect_free(self, x, y, w, h):
+        """
+        Checks whether the w x h rectangle of top left cell (x,y) lies
+        within the box and has no block.
+        """
+        if x < 0 or y < 0 or x + w > self.lx or y + h > self.ly:
+            return False
+        return self.blocks(x, y, w, h) == 0
+
+# LABYRINTH FILES
+
+    # Binary format: a header of 24 bytes (the magic b'RLAB', the encoding
+    # byte, 3 bytes of padding and the dimensions lx, ly as little endian
+    # unsigned 64-bit integers) followed by the cells row by row, either one
+    # byte per cell (0 air, 1 block) or packed 8 cells per byte, each row
+    # padded to a whole number of bytes.
+
+LAB_MAGIC = b'RLAB'
+LAB_HEADER = struct.Struct('<4sB3xQQ')
+BYTE_PER_CELL, BIT_PACKED = 0, 1
+
+def save_lab(lab, path, packed = False):
+    """
+    This function writes the labyrinth to a binary file.
+
+    Inputs:
+        - lab: the list of lists encoding the labyrinth (or its occupancy array)
+        - path: the file to write
+        - packed (optional): whether to pack 8 cells per byte; the file is
+            then 8 times smaller but cannot be mapped without unpacking it
+    """
+    occupancy = lab2array(lab)
+    ly, lx = occupancy.shape
+    with open(path, 'wb') as f:
+        f.write(LAB_HEADER.pack(LAB_MAGIC, BIT_PACKED if packed else BYTE_PER_CELL, lx, ly))
+        if packed:
+            np.packbits(occupancy, axis = 1, bitorder = 'little').tofile(f)
+        else:
+            occupancy.astype(np.uint8).tofile(f)
+
+def read_lab_header(path):
+    """ Gives the encoding and the dimensions (lx, ly) of a labyrinth file """
+    with open(path, 'rb') as f:
+        header = f.read(LAB_HEADER.size)
+    if len(header) < LAB_HEADER.size:
+        raise ValueError("Not a labyrinth file.")
+    magic, encoding, lx, ly = LAB_HEADER.unpack(header)
+    if magic != LAB_MAGIC or encoding not in (BYTE_PER_CELL, BIT_PACKED):
+        raise ValueError("Not a labyrinth file.")
+    return encoding, (lx, ly)
+
+def load_lab(path):
+    """
+    This function opens a labyrinth file. A file of one byte per cell is
+    memory mapped, and the array given is a view of the file: the cells
+    are only read from disk when they are accessed.
+
+    Input:
+        - path: the file written by save_lab( )
+    Output:
+        - a read only boolean occupancy array of shape (ly, lx)
+    """
+    encoding, (lx, ly) = read_lab_header(path)
+    if encoding == BIT_PACKED:
+        packed = np.fromfile(path, dtype = np.uint8, offset = LAB_HEADER.size)
+        packed = packed.reshape(ly, (lx + 7) // 8)
+        return np.unpackbits(packed, axis = 1, count = lx, bitorder = 'little').view(bool)
+    cells = np.memmap(path, dtype = np.uint8, mode = 'r', offset = LAB_HEADER.size,
+                      shape = (ly, lx))
+    return cells.view(bool) # the bytes are 0 or 1, valid booleans
+
+def read_lab_text(source):
+    """
+    This function parses a labyrinth written as text, one row per line with
+    '.' for air and '#' for a block, of any width and height. The lines are
+    read one by one into a byte buffer, no string is created per cell.
+
+    Input:
+        - source: a path, or a file object opened in binary mode
+    Output:
+        - a boolean occupancy array of shape (ly, lx)
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return read_lab_text(f)
+
+    cells = bytearray()
+    lx = None
+    ly = 0
+    for line in source:
+        row = line.rstrip(b'\r\n')
+        if not row:
+            continue
+        if lx is None:
+            lx = len(row)
+        if len(row) != lx or row.count(b'.') + row.count(b'#') != lx:
+            raise ValueError(f"Invalid labyrinth! (row {ly})")
+        cells += row
+        ly += 1
+    if lx is None:
+        raise ValueError("Invalid labyrinth!")
+    return (np.frombuffer(cells, dtype = np.uint8) == ord('#')).reshape(ly, lx)
+
 # FUNCTIONS RELATED TO ROD - LABYRINTH INTERACTION
 
 
@@ -201,10 +627,14 @@ def point_collision(x,y,lab):
     """
     This function checks whether a point is a solid block of the labyrinth.
     """
-    lx,ly = get_shape(lab)
-    if not point_in_box(x,y,lx,ly):
+    # the rows are assumed to be validated already, checking the shape
+    # again for every single point is too expensive
+    if not point_in_box(x,y,len(lab[0]),len(lab)):
         return False # otherwise we cannot test if the point is a block
-    return (lab[y][x] == '#') 
+    cell = lab[y][x]
+    if isinstance(cell, str):
+        return (cell == '#')
+    return bool(cell) # occupancy arrays, see lab2array( )
 
 def rod_collision(rod, lab):
     """
@@ -216,6 +646,13 @@ def rod_collision(rod, lab):
     Outpus:
         - a boolean, True if there is a collision or exits the box, False otherwise.
     """
+    if isinstance(lab, Labyrinth): # one lookup of the summed-area table
+        x, y, o = rod
+        l = 2*RADIUS + 1
+        if o:
+            return not lab.rect_free(x, y - RADIUS, 1, l)
+        return not lab.rect_free(x - RADIUS, y, l, 1)
+
     len_x, len_y = get_shape(lab)
     if not sits_in_box(rod, len_x, len_y):
         return True
@@ -242,6 +679,9 @@ def can_rotate(rod, lab, verbose = False):
     x,y,o = rod
     l = 2*RADIUS + 1
 
+    if isinstance(lab, Labyrinth) and not verbose:
+        return lab.rect_free(x - RADIUS, y - RADIUS, l, l)
+
     xs = [x + shift for shift in range(-RADIUS,RADIUS+1)]
     ys = [y + shift for shift in range(-RADIUS,RADIUS+1)]
     lx,ly = get_shape(lab)
@@ -265,7 +705,7 @@ def print_all(rod, lab, omit_rod = False):
         - rod: a tuple containing x,y position of center and orientation
         - lab: the list of lists encoding the labyrinth
     """
-    print_lab = copy.deepcopy(lab)
+    print_lab = [['#' if cell else '.' for cell in row] for row in lab2array(lab).tolist()]
 
 
     len_x, len_y = get_shape(lab)
@@ -306,7 +746,7 @@ def show_config(rod,lab):
 
 # FUNCTIONS RELATED TO LABYRINTH EXPLORATION
 
-def allowed_moves(rod, lab, delta = 1, give_neighbors = False):
+def allowed_moves(rod, lab, delta = 1, give_neighbors = False, masks = None):
     """
     This function gives the allowed moves for a given configuration of the
     rod and the lab. It checks whether the shifted (defaulte 1 unit of shift)
@@ -320,24 +760,45 @@ def allowed_moves(rod, lab, delta = 1, give_neighbors = False):
         - delta (optional): the size of steps that can be taken in shifts (default 1)
         - give_neighbors (optional): when set to true, the function will 
             output a list of tuples, all accesible rod states from the given one
+        - masks (optional): the output of rod_masks(lab), to avoid computing
+            it again when the function is called repeatedly on the same lab
     Output:
         - a string composed of the possible shifts and moves, 
             encoded as 'e','w','s','n','r'
     """
 
-    len_x, len_y = get_shape(lab)
+    if masks is None and isinstance(lab, Labyrinth):
+        # a few rectangles of its summed-area table, rather than the whole grid
+        l = 2*RADIUS + 1
+        x, y, o = rod
+        fits = lambda x, y, o: lab.rect_free(x, y - RADIUS, 1, l) if o else \
+                               lab.rect_free(x - RADIUS, y, l, 1)
+        neighbors = [(s, shift_rod(rod, s, delta)) for s in "ewsn"]
+        neighbors = [(s, n) for s, n in neighbors if fits(*n)]
+        if lab.rect_free(x - RADIUS, y - RADIUS, l, l): # the L x L box is free
+            neighbors.append(("r", rotate_rod(rod)))
+        if give_neighbors:
+            return [n for s, n in neighbors]
+        return "".join(s for s, n in neighbors)
+
+    if masks is None:
+        masks = rod_masks(lab)
+    hor, ver, rot = masks
+    len_y, len_x = hor.shape
 
     moves = ""
     list_of_neighbors = []
 
     for s in "ewsn": # test which shifts are allowed (sit within box, don't collide)
-        possible_rod = shift_rod(rod, s)
-        if sits_in_box(possible_rod, len_x, len_y) & (not rod_collision(possible_rod, lab)):
+        possible_rod = shift_rod(rod, s, delta)
+        x, y, o = possible_rod
+        if point_in_box(x, y, len_x, len_y) and (ver if o else hor)[y, x]:
             moves = moves + s
             if give_neighbors:
                 list_of_neighbors.append(possible_rod)
 
-    if can_rotate(rod, lab): # already implemented function for checking allowed rotation
+    x, y, o = rod
+    if point_in_box(x, y, len_x, len_y) and rot[y, x]: # the L x L box is free
         moves = moves + "r"
         if give_neighbors:
             list_of_neighbors.append(rotate_rod(rod))
@@ -356,31 +817,29 @@ def config_space(lab, verbose = False, count_states = False):
     Inputs:
         - lab: the list of lists encoding the labyrinth
     Output:
-        - a list of all the possible rod arrays that are valid
+        - a list of all the possible rod arrays that are valid, ordered
+            by x, then y, then orientation
     """
-    len_x, len_y = get_shape(lab)
-
-    # we assume that the labyrinth is valid
-
-    configurations = []
-    count = 0
-
-    for x in range(0,len_x):
-        for y in range(0,len_y):
-            for o in [0,1]:
-                rod = (x,y,o)
-                if all([sits_in_box(rod, len_x, len_y), not(rod_collision(rod,lab))]):
-                    if verbose:
-                        print(f"Rod {rod} is viable")
-                        print(f"In box: {sits_in_box(rod, len_x, len_y)}")
-                        print(f"Collision: {rod_collision(rod,lab)}")
-                        show_config(rod,lab)
-                    configurations.append(rod)
-                    count += 1
-                elif verbose:
-                    print(f"Rod {rod} is not viable")
+    hor, ver, rot = rod_masks(lab)
+
+    # stacking the masks as [x, y, o] gives the states in the order above
+    valid = np.stack([hor, ver], axis = -1).transpose(1, 0, 2)
+    xs, ys, os = np.nonzero(valid)
+    configurations = list(zip(xs.tolist(), ys.tolist(), os.tolist()))
+    count = len(configurations)
+
+    if verbose:
+        len_x, len_y = get_shape(lab)
+        for x in range(0,len_x):
+            for y in range(0,len_y):
+                for o in [0,1]:
+                    rod = (x,y,o)
+                    viable = bool(valid[x, y, o])
+                    print(f"Rod {rod} is {'viable' if viable else 'not viable'}")
                     print(f"In box: {sits_in_box(rod, len_x, len_y)}")
                     print(f"Collision: {rod_collision(rod,lab)}")
+                    if viable:
+                        show_config(rod,lab)
 
     if count_states:
         return configurations, count
@@ -388,7 +847,7 @@ def config_space(lab, verbose = False, count_states = False):
         return configurations
 
 
-def touches_target(rod,xt,yt):
+def touches_target(rod,xt,yt, piece = None):
     """
     This function checks whether a rod given by a tuple touches a target 
     coordinate. It checks ALL rod nodes, just in case the target is not
@@ -397,27 +856,1275 @@ def touches_target(rod,xt,yt):
     Input:
         - rod: a tuple containing x,y position of center and orientation
         - xt, yt: integer coordinates to check
+        - piece (optional): the Piece in place of the rod
     Output:
         - bool
     """
+    if piece is not None:
+        return (xt, yt) in piece.cells(rod)
     x,y,o = rod
-    if not o: # vertical
-        #print("Hor")
-        #print([(x+1,y) == (xt,yt), (x,y) == (xt, yt), (x-1,y) == (xt,yt)])
-        return any([(x+1,y) == (xt,yt), (x,y) == (xt, yt), (x-1,y) == (xt,yt)])
-    else: # horizontal
-        #print("Vertical")
-        #print([(x,y+1) == (xt,yt), (x,y) == (xt, yt), (x,y-1) == (xt,yt)])
-        return any([(x,y+1) == (xt,yt), (x,y) == (xt, yt), (x,y-1) == (xt,yt)])
+    if not o: # horizontal
+        return y == yt and abs(x - xt) <= RADIUS
+    else: # vertical
+        return x == xt and abs(y - yt) <= RADIUS
      
 
+# COMPILED CONFIGURATION GRAPH
+
+    # Every valid rod state (x,y,o) gets a dense integer id, in the order of
+    # config_space( ), and the neighbors of each state are stored in CSR
+    # style: the neighbors of the state i are indices[indptr[i]:indptr[i+1]],
+    # listed in the order of allowed_moves( ) ('e','w','s','n','r', and 'l'
+    # for the pieces with four orientations). The graph of another piece
+    # than the rod is built the same way from its masks, so the searches
+    # do not depend on the size of the piece.
+
+SHIFTS = [('e', 1, 0), ('w', -1, 0), ('s', 0, 1), ('n', 0, -1)]
+MOVES = 'ewsnrl' # the moves of the pieces, in the order of the neighbors
+
+class CompiledLab:
+    """
+    The graph of rod configurations of a labyrinth, built once and reused
+    by every query on the same labyrinth.
+
+    Attributes:
+        - shape: the dimensions (lx, ly) of the labyrinth
+        - piece: the Piece moved in the labyrinth, None for the rod
+        - masks: the output of rod_masks(lab), or of piece_masks(lab, piece)
+        - states: an integer array of shape (V, 3), the (x,y,o) of every state
+        - ids: an integer array of shape (ly, lx, n), n being the number of
+            orientations (2 for the rod), the id of the state (x,y,o) at
+            [y, x, o], -1 if it is not valid
+        - indptr, indices: the CSR arrays of the adjacency
+        - moves: an integer array along indices, the position in MOVES of
+            the move leading to each neighbor
+    """
+
+    def __init__(self, lab, piece = None):
+        occupancy = lab2array(lab)
+        ly, lx = occupancy.shape
+        self.shape = (lx, ly)
+        self.piece = piece
+        if isinstance(lab, Labyrinth): # its summed-area table is reused
+            occupancy = lab
+        if piece is None:
+            self.masks = hor, ver, rot = rod_masks(occupancy)
+            valid, turns = np.stack([hor, ver]), [('r', 1, np.stack([rot, rot]))]
+        else:
+            self.masks = valid, turn_masks = piece_masks(occupancy, piece)
+            turns = [(move, step, turn_masks[move]) for move, step in piece.turns]
+        n = len(valid) # the number of orientations
+
+        xs, ys, os = np.nonzero(valid.transpose(2, 1, 0)) # ordered by x, y, o
+        n_states = len(xs)
+        self.states = np.stack([xs, ys, os], axis = -1)
+        self.ids = np.full((ly, lx, n), -1, dtype = np.intp)
+        self.ids[ys, xs, os] = np.arange(n_states)
+
+        # one column per move, -1 where the move is not allowed
+        padded = np.full((ly + 2, lx + 2, n), -1, dtype = np.intp)
+        padded[1:-1, 1:-1] = self.ids
+        neighbors = np.empty((n_states, len(SHIFTS) + len(turns)), dtype = np.intp)
+        for k, (s, dx, dy) in enumerate(SHIFTS):
+            neighbors[:, k] = padded[ys + 1 + dy, xs + 1 + dx, os]
+        for k, (move, step, mask) in enumerate(turns, len(SHIFTS)):
+            neighbors[:, k] = np.where(mask[os, ys, xs], self.ids[ys, xs, (os + step) % n], -1)
+        codes = np.array([MOVES.index(s) for s, _, _ in SHIFTS] +
+                         [MOVES.index(move) for move, _, _ in turns], dtype = np.uint8)
+
+        allowed = neighbors >= 0
+        self.indptr = np.zeros(n_states + 1, dtype = np.intp)
+        np.cumsum(allowed.sum(axis = 1), out = self.indptr[1:])
+        self.indices = neighbors[allowed]
+        self.moves = codes[np.nonzero(allowed)[1]]
+        self._lists = None
+        self.fields = LabCache(maxsize = 8) # distance fields, by target
+        self.components = None # the ComponentIndex, see component_index( )
+
+    def __len__(self):
+        return len(self.states)
+
+    def state_id(self, rod):
+        """ Gives the id of the rod state, -1 if it is not valid """
+        x, y, o = rod
+        lx, ly = self.shape
+        if not point_in_box(x, y, lx, ly):
+            return -1
+        return int(self.ids[y, x, o])
+
+    def state(self, i):
+        """ Gives the rod tuple (x,y,o) of the state of id i """
+        x, y, o = self.states[i].tolist()
+        return (x, y, o)
+
+    def adjacency(self):
+        """
+        Gives the CSR arrays as python lists, which are much faster than
+        numpy arrays when accessed one element at a time in a search loop.
+        """
+        if self._lists is None:
+            self._lists = (self.indptr.tolist(), self.indices.tolist())
+        return self._lists
+
+    def touching_states(self, tx, ty):
+        """ Gives the set of ids of the states in which the rod touches (tx,ty) """
+        goals = set()
+        footprints = (self.piece or rod_piece()).footprints
+        for o, cells in enumerate(footprints):
+            for dx, dy in cells:
+                i = self.state_id((tx - dx, ty - dy, o))
+                if i >= 0:
+                    goals.add(i)
+        return goals
+
+class LabCache:
+    """
+    A bounded cache which keeps the most recently used entries and evicts
+    the least recently used one when it is full. It counts its hits,
+    misses and evictions.
+    """
+
+    def __init__(self, maxsize = 16):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, build):
+        """
+        Gives the entry stored under key, calling build( ) to create it
+        if it is not there.
+        """
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        self.misses += 1
+        value = build()
+        self._entries[key] = value
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last = False)
+            self.evictions += 1
+        return value
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def info(self):
+        """ Gives a dictionary with the counters and the size of the cache """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._entries),
+                'maxsize': self.maxsize}
+
+    def clear(self):
+        """ Empties the cache and resets its counters """
+        self._entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+LAB_CACHE = LabCache()
+
+def lab_key(lab):
+    """
+    Gives a hashable key identifying the contents of the labyrinth, namely
+    its shape, the rod radius and a digest of its occupancy grid.
+    """
+    if isinstance(lab, Labyrinth) and lab.key[1] == RADIUS: # hashed once
+        return lab.key
+    occupancy = np.ascontiguousarray(lab2array(lab))
+    digest = hashlib.blake2b(occupancy.data, digest_size = 16).hexdigest()
+    return (occupancy.shape, RADIUS, digest)
+
+def compile_lab(lab, use_cache = True, piece = None):
+    """
+    This function builds the configuration graph of the labyrinth, taking
+    it from LAB_CACHE when the same labyrinth has been compiled before.
+
+    Inputs:
+        - lab: the list of lists encoding the labyrinth (or its occupancy array)
+        - use_cache (optional): whether to look up and store the graph in LAB_CACHE
+        - piece (optional): the Piece moved in the labyrinth, the rod by default
+    Output:
+        - a CompiledLab
+    """
+    if piece is not None and piece == rod_piece():
+        piece = None # the rod has its own masks
+    if not use_cache:
+        return CompiledLab(lab, piece)
+    if not isinstance(lab, Labyrinth): # which keeps its key and summed-area table
+        lab = lab2array(lab)
+    key = lab_key(lab) if piece is None else (lab_key(lab), piece.key)
+    return LAB_CACHE.get(key, lambda: CompiledLab(lab, piece))
+
+def csr_neighbors(graph, frontier):
+    """
+    Gives, for an array of state ids, the concatenated neighbors of all of
+    them, together with the state each neighbor comes from. Both are
+    gathered from the CSR arrays with vectorized operations.
+    """
+    starts = graph.indptr[frontier]
+    counts = graph.indptr[frontier + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    positions = offsets + np.arange(offsets.size)
+    return graph.indices[positions], np.repeat(frontier, counts)
+
+def layered_bfs(graph, seeds):
+    """
+    Breadth first search from several seed states at once, advancing a
+    whole layer per iteration with array operations.
+
+    Inputs:
+        - graph: a CompiledLab
+        - seeds: an iterable of state ids, all at distance 0
+    Output:
+        - an integer array with the distance of every state to the nearest
+            seed, -1 for the states that cannot be reached
+    """
+    dist = np.full(len(graph), -1, dtype = np.int32)
+    frontier = np.unique(np.fromiter(seeds, dtype = np.intp))
+    dist[frontier] = 0
+    d = 0
+    while frontier.size:
+        neighbors, _ = csr_neighbors(graph, frontier)
+        frontier = np.unique(neighbors[dist[neighbors] < 0])
+        d += 1
+        dist[frontier] = d
+    return dist
+
+def distance_field(lab, target = None, piece = None):
+    """
+    This function computes the number of moves needed to make the rod touch
+    the target block from every configuration of the labyrinth, with a single
+    backward search from all the configurations that touch the target (the
+    moves of the rod are reversible). The field is kept along with the
+    compiled labyrinth, and solution( ) looks the distances up in it.
+
+    Inputs:
+        - lab: the list of lists encoding the labyrinth (or its occupancy array)
+        - target (optional): a tuple of 2 integers, the bottom right block by default
+        - piece (optional): the Piece moved in the labyrinth, the rod by default
+    Output:
+        - a read only integer array of shape (ly, lx, n), n being the number of
+            orientations (2 for the rod), the distance for the rod (x,y,o)
+            being at [y, x, o], -1 if the target cannot be reached from there
+            or the configuration is not valid
+    """
+    graph = compile_lab(lab, piece = piece)
+    lx, ly = graph.shape
+    if target == None:
+        target = (lx-1,ly-1)
+    target = tuple(target)
+
+    def build():
+        dist = layered_bfs(graph, graph.touching_states(*target))
+        field = np.full(graph.ids.shape, -1, dtype = np.int32)
+        xs, ys, os = graph.states.T
+        field[ys, xs, os] = dist
+        field.setflags(write = False)
+        return field
+
+    return graph.fields.get(target, build)
+
+def touch_distance_map(lab, source = (1,0,0), piece = None):
+    """
+    This function computes the number of moves needed to make the rod touch
+    every block of the labyrinth, starting from the source configuration.
+    A single forward search gives the distance of every state, and each
+    block takes the minimum over the states whose rod covers it (see
+    touches_target( )), instead of one search per block.
+
+    Inputs:
+        - lab: the list of lists encoding the labyrinth (or its occupancy array)
+        - source: a tuple of 3 integers, the initial configuration of the rod
+        - piece (optional): the Piece moved in the labyrinth, the rod by default
+    Output:
+        - an integer array of shape (ly, lx), the distance at [y, x] being the
+            one solution(lab, source, (x,y)) gives, -1 for the blocks that
+            cannot be touched
+    """
+    graph = compile_lab(lab, piece = piece)
+    lx, ly = graph.shape
+    s = graph.state_id(source)
+    if s < 0:
+        raise ValueError("The initial configuration of rod collides with the labyrinth.")
+
+    dist = layered_bfs(graph, [s])
+    reached = dist >= 0
+    xs, ys, os = graph.states[reached].T
+    dist = dist[reached]
+
+    unreached = np.iinfo(np.int32).max
+    heatmap = np.full((ly, lx), unreached, dtype = np.int32)
+    for o, cells in enumerate((graph.piece or rod_piece()).footprints):
+        in_o = os == o
+        for dx, dy in cells: # the cells covered by the rod
+            np.minimum.at(heatmap, (ys[in_o] + dy, xs[in_o] + dx), dist[in_o])
+    heatmap[heatmap == unreached] = -1
+    return heatmap
+
+# CONNECTED COMPONENTS
+
+    # The moves of the rod are reversible, so the configuration graph splits
+    # into connected components, and the target can be reached from the
+    # source iff one of the states touching it lies in the component of the
+    # source. The components are found with array operations: every edge
+    # hooks the root of its larger end under the root of its smaller end,
+    # then the trees are flattened by pointer jumping, until no edge joins
+    # two different roots.
+
+class ComponentIndex:
+    """
+    The labeling of the connected components of the configuration graph
+    of a labyrinth.
+
+    Attributes:
+        - graph: the CompiledLab
+        - labels: an integer array, the component of every state, numbered
+            by order of their smallest state id
+        - sizes: an integer array, the number of states of every component
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        n_states = len(graph)
+        rows = np.repeat(np.arange(n_states), np.diff(graph.indptr))
+        cols = graph.indices
+        parent = np.arange(n_states)
+        while True:
+            pu, pv = parent[rows], parent[cols]
+            joined = pu != pv
+            if not joined.any():
+                break
+            np.minimum.at(parent, np.maximum(pu, pv)[joined], np.minimum(pu, pv)[joined])
+            while True: # pointer jumping, until every state points to its root
+                grand = parent[parent]
+                if np.array_equal(grand, parent):
+                    break
+                parent = grand
+        _, self.labels = np.unique(parent, return_inverse = True)
+        self.sizes = np.bincount(self.labels)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def component(self, rod):
+        """ Gives the component of the rod state, -1 if it is not valid """
+        i = self.graph.state_id(rod)
+        return int(self.labels[i]) if i >= 0 else -1
+
+    def size(self, rod):
+        """ Gives the number of states reachable from the rod state (itself included) """
+        c = self.component(rod)
+        return int(self.sizes[c]) if c >= 0 else 0
+
+    def can_reach(self, source, target):
+        """ Checks whether the rod can touch the target block from the source state """
+        c = self.component(source)
+        goals = self.graph.touching_states(*target)
+        return c >= 0 and any(self.labels[i] == c for i in goals)
+
+    def reachable_states(self, source):
+        """ Gives the array (V, 3) of the states (x,y,o) reachable from the source """
+        c = self.component(source)
+        return self.graph.states[self.labels == c] if c >= 0 else self.graph.states[:0]
+
+    def reachable_cells(self, source):
+        """
+        Gives a boolean array of shape (ly, lx), True on the cells that the
+        rod can cover starting from the source state.
+        """
+        lx, ly = self.graph.shape
+        cells = np.zeros((ly, lx), dtype = bool)
+        xs, ys, os = self.reachable_states(source).T
+        for o, footprint in enumerate((self.graph.piece or rod_piece()).footprints):
+            for dx, dy in footprint:
+                cells[ys[os == o] + dy, xs[os == o] + dx] = True
+        return cells
+
+def component_index(lab, piece = None):
+    """
+    This function labels the connected components of the configuration
+    graph of the labyrinth. The index is kept along with the compiled
+    labyrinth, and once it is built solution( ) uses it to answer at once
+    the queries with no path.
+
+    Inputs:
+        - lab: the list of lists encoding the labyrinth (or its occupancy array)
+        - piece (optional): the Piece moved in the labyrinth, the rod by default
+    Output:
+        - a ComponentIndex
+    """
+    graph = compile_lab(lab, piece = piece)
+    if graph.components is None:
+        graph.components = ComponentIndex(graph)
+    return graph.components
+
+# SEARCH ENGINES
+
+    # An engine receives the compiled graph, the id of the source state, the
+    # set of ids of the goal states and the target block (used by the engines
+    # guided by a heuristic). It returns the lists of distances and
+    # predecessors (-1 for the states not visited, resp. without
+    # predecessor), the id of the goal state reached first (-1 if no
+    # goal can be reached) and a dictionary of counters of the search:
+    # 'expanded' the number of states whose neighbors were explored, 'pushes'
+    # and 'pops' the operations on the queue. They are computed from the
+    # sizes of the structures when possible, to keep the loops untouched.
+
+def bfs_search(graph, source, goals, target = None):
+    """
+    Breadth first search from the source state. Since every move costs one
+    unit, the first time a state is discovered its distance is already the
+    minimal one, so a simple FIFO queue replaces the priority queue of the
+    Dijkstra algorithm and every state is visited at most once: O(V + E).
+
+    Inputs:
+        - graph: a CompiledLab
+        - source: the id of the initial state
+        - goals: a set of ids of goal states
+        - target (optional): the target block, not used
+    Outputs:
+        - dist: a list of distances to the source of the visited states
+        - prev: a list mapping each visited state to its predecessor
+        - access: the first goal state found, -1 if there is none
+        - counters: a dictionary with the number of expanded states
+    """
+    indptr, indices = graph.adjacency()
+    dist = [-1]*len(graph)
+    prev = [-1]*len(graph)
+    dist[source] = 0
+    queue = deque([source])
+    expanded = 0
+
+    while queue:
+        u = queue.popleft()
+        if u in goals:
+            return dist, prev, u, {'expanded': expanded, 'pops': expanded + 1,
+                                   'pushes': expanded + 1 + len(queue)}
+        expanded += 1
+        d = dist[u] + 1
+        for n in indices[indptr[u]:indptr[u+1]]:
+            if dist[n] < 0: # the distance list doubles as the visited set
+                dist[n] = d
+                prev[n] = u
+                queue.append(n)
+    return dist, prev, -1, {'expanded': expanded, 'pops': expanded, 'pushes': expanded}
+
+def dijkstra_search(graph, source, goals, target = None, cost = None):
+    """
+    Dijkstra algorithm with a binary heap, for graphs whose edges may have
+    different (non negative) costs. Stale heap entries are skipped when popped.
+
+    Inputs:
+        - graph, source, goals, target: as in bfs_search( )
+        - cost (optional): a function giving the cost of the edge (u, n),
+            every edge costs 1 by default
+    Outputs:
+        - dist, prev, access, counters: as in bfs_search( )
+    """
+    indptr, indices = graph.adjacency()
+    dist = [-1]*len(graph)
+    prev = [-1]*len(graph)
+    visited = [False]*len(graph)
+    dist[source] = 0
+    heap = [(0, source)]
+    expanded = pops = 0
+
+    while heap:
+        d, u = heapq.heappop(heap)
+        pops += 1
+        if visited[u]:
+            continue
+        visited[u] = True
+        if u in goals:
+            return dist, prev, u, {'expanded': expanded, 'pops': pops, 'pushes': pops + len(heap)}
+        expanded += 1
+        for n in indices[indptr[u]:indptr[u+1]]:
+            if visited[n]:
+                continue
+            possibly_new_distance = d + (1 if cost is None else cost(u, n))
+            if dist[n] < 0 or possibly_new_distance < dist[n]:
+                dist[n] = possibly_new_distance
+                prev[n] = u
+                heapq.heappush(heap, (possibly_new_distance, n))
+    return dist, prev, -1, {'expanded': expanded, 'pops': pops, 'pushes': pops}
+
+def rod_heuristic(graph, tx, ty):
+    """
+    Lower bound of the number of moves needed to make the rod touch the
+    target block from every state of the graph. It is the exact distance
+    in the labyrinth without obstacles nor walls: the Manhattan distance
+    from the nearest rod cell to the target, and if the rod touches the
+    target sooner in the other orientation, one rotation plus that
+    distance for the rotated rod. Obstacles can only make the way longer,
+    so the bound is admissible, and since it is a true distance (in a
+    bigger graph) it is also consistent. For another piece, the bound is the
+    least number of rotations to each orientation plus the Manhattan
+    distance from the nearest cell of the piece in that orientation.
+
+    Inputs:
+        - graph: a CompiledLab
+        - tx, ty: the coordinates of the target block
+    Output:
+        - a list with the lower bound of every state
+    """
+    return heuristic_bounds(graph.states, tx, ty, graph.piece).tolist()
+
+def heuristic_bounds(states, tx, ty, piece = None):
+    """
+    Gives the bounds of rod_heuristic( ) for an integer array (N, 3) of
+    states (x,y,o), as an array.
+    """
+    xs, ys, os = np.asarray(states).reshape(-1, 3).T
+    if piece is not None:
+        n = len(piece)
+        bound = np.full(len(xs), np.iinfo(np.int64).max)
+        for o, cells in enumerate(piece.footprints):
+            nearest = np.min([np.abs(xs + dx - tx) + np.abs(ys + dy - ty)
+                              for dx, dy in cells], axis = 0)
+            turns = (o - os) % n
+            if n > 2: # turning both ways
+                turns = np.minimum(turns, n - turns)
+            bound = np.minimum(bound, nearest + turns)
+        return bound
+    adx = np.abs(xs - tx)
+    ady = np.abs(ys - ty)
+    d_hor = np.maximum(adx - RADIUS, 0) + ady # nearest cell of a horizontal rod
+    d_ver = adx + np.maximum(ady - RADIUS, 0) # nearest cell of a vertical rod
+    own = np.where(os == 0, d_hor, d_ver)
+    rotated = np.where(os == 0, d_ver, d_hor) + 1
+    return np.minimum(own, rotated)
+
+def state_bound(tx, ty, piece = None):
+    """
+    Gives rod_heuristic( ) as a function of a single state (x,y,o), for the
+    searches which only look at a few states: nothing is computed for the
+    states they never reach.
+    """
+    if piece is not None:
+        n = len(piece)
+        footprints = piece.footprints
+
+        def bound(x, y, o):
+            best = None
+            for p, cells in enumerate(footprints):
+                turns = (p - o) % n
+                if n > 2: # turning both ways
+                    turns = min(turns, n - turns)
+                d = turns + min(abs(x + dx - tx) + abs(y + dy - ty) for dx, dy in cells)
+                best = d if best is None else min(best, d)
+            return best
+        return bound
+
+    def bound(x, y, o):
+        adx, ady = abs(x - tx), abs(y - ty)
+        d_hor = max(adx - RADIUS, 0) + ady
+        d_ver = adx + max(ady - RADIUS, 0)
+        return min(d_ver, d_hor + 1) if o else min(d_hor, d_ver + 1)
+    return bound
+
+def astar_search(graph, source, goals, target):
+    """
+    A* search: states are expanded in order of distance to the source plus
+    the bound of rod_heuristic( ) to the target, computed only for the
+    states pushed (see state_bound( )), ties broken in favour of the
+    deepest state. The heuristic being consistent, a state is never expanded twice
+    and the first goal popped is at minimal distance.
+
+    Inputs:
+        - graph, source, goals: as in bfs_search( )
+        - target: the (tx,ty) block, used by the heuristic
+    Outputs:
+        - dist, prev, access, counters: as in bfs_search( )
+    """
+    indptr, indices = graph.adjacency()
+    bound = state_bound(*target, piece = graph.piece)
+    h = lambda i: bound(*graph.state(i)) # only for the states pushed
+    dist = [-1]*len(graph)
+    prev = [-1]*len(graph)
+    closed = [False]*len(graph)
+    dist[source] = 0
+    heap = [(h(source), 0, source)]
+    expanded = pops = 0
+
+    while heap:
+        _, _, u = heapq.heappop(heap)
+        pops += 1
+        if closed[u]:
+            continue
+        closed[u] = True
+        if u in goals:
+            return dist, prev, u, {'expanded': expanded, 'pops': pops, 'pushes': pops + len(heap)}
+        expanded += 1
+        d = dist[u] + 1
+        for n in indices[indptr[u]:indptr[u+1]]:
+            if closed[n]:
+                continue
+            if dist[n] < 0 or d < dist[n]:
+                dist[n] = d
+                prev[n] = u
+                heapq.heappush(heap, (d + h(n), -d, n))
+    return dist, prev, -1, {'expanded': expanded, 'pops': pops, 'pushes': pops}
+
+def bidirectional_search(graph, source, goals, target = None):
+    """
+    Bidirectional breadth first search: one search goes forward from the
+    source and the other backward from all the goal states at once (the
+    moves of the rod are reversible), always expanding a whole layer of
+    the smaller frontier. A state labelled by both searches gives a path;
+    the search stops once no shorter path can still be found, namely when
+    the best path is not longer than the sum of the depths of both searches.
+
+    Inputs:
+        - graph, source, goals, target: as in bfs_search( )
+    Outputs:
+        - dist, prev, access, counters: as in bfs_search( ). The distances
+            are those of the forward search, completed along the path found.
+    """
+    indptr, indices = graph.adjacency()
+    dist = [-1]*len(graph)       # forward distances
+    prev = [-1]*len(graph)
+    dist_back = [-1]*len(graph)  # backward distances
+    next_back = [-1]*len(graph)  # next state on the way to a goal
+    dist[source] = 0
+    for g in goals:
+        dist_back[g] = 0
+    front, front_back = [source], list(goals)
+    depth = depth_back = 0
+    best, meet = (0, source) if source in goals else (-1, -1)
+    expanded = 0
+    pushes = 1 + len(front_back)
+
+    while best < 0 or best > depth + depth_back:
+        if not front or not front_back:
+            break
+        forward = len(front) <= len(front_back)
+        if forward:
+            labels, links, others, layer = dist, prev, dist_back, front
+        else:
+            labels, links, others, layer = dist_back, next_back, dist, front_back
+        new_layer = []
+        for u in layer:
+            expanded += 1
+            d = labels[u] + 1
+            for n in indices[indptr[u]:indptr[u+1]]:
+                if labels[n] < 0:
+                    labels[n] = d
+                    links[n] = u
+                    new_layer.append(n)
+                    if others[n] >= 0 and (best < 0 or d + others[n] < best):
+                        best, meet = d + others[n], n
+        pushes += len(new_layer)
+        if forward:
+            front, depth = new_layer, depth + 1
+        else:
+            front_back, depth_back = new_layer, depth_back + 1
+
+    counters = {'expanded': expanded, 'pops': expanded, 'pushes': pushes}
+    if best < 0:
+        return dist, prev, -1, counters
+
+    # the second half of the path is written in the forward lists
+    u = meet
+    while next_back[u] >= 0 and dist_back[u] > 0:
+        n = next_back[u]
+        dist[n] = dist[u] + 1
+        prev[n] = u
+        u = n
+    return dist, prev, u, counters
+
+def move_costs(costs = None):
+    """
+    Gives the list of the costs of the moves, in the order of MOVES, from a
+    dictionary of integer costs by move letter (1 for the missing moves).
+    """
+    costs = dict(costs or {})
+    unknown = set(costs) - set(MOVES)
+    if unknown:
+        raise ValueError(f"Unknown moves {sorted(unknown)}, the moves are {MOVES!r}.")
+    values = [costs.get(move, 1) for move in MOVES]
+    if any(not isinstance(c, (int, np.integer)) or c < 0 for c in values):
+        raise ValueError("The costs of the moves must be non negative integers.")
+    return [int(c) for c in values]
+
+def dial_search(graph, source, goals, target = None, costs = None):
+    """
+    Dijkstra algorithm with a bucket queue (Dial's algorithm), for integer
+    costs of the moves. A state of cost d waits in the bucket d modulo
+    C + 1, C being the largest cost, and the buckets are emptied in order
+    of cost, in O(V + E + C * maxdist) instead of the O(E log V) of the heap.
+    Inside a bucket the states are taken by number of moves (a small heap),
+    so that the pairs (cost, moves) are settled in lexicographic order: the
+    first goal taken is the one of fewest moves among those of least cost,
+    the moves of cost 0 included.
+
+    Inputs:
+        - graph, source, goals, target: as in bfs_search( )
+        - costs (optional): a dictionary of the integer costs of the moves
+            'e', 'w', 's', 'n' and 'r', every move costs 1 by default
+    Outputs:
+        - dist, prev, access, counters: as in bfs_search( ), dist being the
+            least cost of each visited state
+    """
+    indptr, indices = graph.adjacency()
+    edge_cost = np.array(move_costs(costs))[graph.moves].tolist()
+    n_buckets = max(edge_cost, default = 0) + 1
+    buckets = [[] for _ in range(n_buckets)]
+    dist = [-1]*len(graph)
+    prev = [-1]*len(graph)
+    steps = [0]*len(graph)
+    settled = [False]*len(graph)
+    dist[source] = 0
+    buckets[0].append((0, source))
+    queued = 1 # the states waiting in the buckets, stale ones included
+    d = expanded = pops = pushes = 0
+
+    while queued:
+        bucket = buckets[d % n_buckets]
+        heapq.heapify(bucket)
+        while bucket: # a move of cost 0 may add to the bucket being emptied
+            k, u = heapq.heappop(bucket)
+            queued -= 1
+            pops += 1
+            if settled[u] or dist[u] != d or steps[u] != k:
+                continue
+            settled[u] = True
+            if u in goals:
+                return dist, prev, u, {'expanded': expanded, 'pops': pops, 'pushes': pushes + 1}
+            expanded += 1
+            for e in range(indptr[u], indptr[u+1]):
+                n = indices[e]
+                if settled[n]:
+                    continue
+                nd = d + edge_cost[e]
+                if dist[n] < 0 or nd < dist[n] or (nd == dist[n] and k + 1 < steps[n]):
+                    dist[n] = nd
+                    prev[n] = u
+                    steps[n] = k + 1
+                    if nd == d:
+                        heapq.heappush(bucket, (k + 1, n))
+                    else:
+                        buckets[nd % n_buckets].append((k + 1, n))
+                    queued += 1
+                    pushes += 1
+        d += 1
+    return dist, prev, -1, {'expanded': expanded, 'pops': pops, 'pushes': pushes + 1}
+
+SEARCH_METHODS = {
+    'bfs': bfs_search,
+    'dijkstra': dijkstra_search,
+    'astar': astar_search,
+    'bidirectional': bidirectional_search,
+    'dial': dial_search,
+}
+
+# BITBOARD ENGINE
+
+    # The labyrinth is packed in a python integer with one bit per cell, the
+    # cell (x,y) being the bit y*lx + x. Shifting the whole board by one
+    # column is a shift by one bit, and by one row a shift by lx bits; the
+    # bits that would wrap around to the neighbouring row are cleared with
+    # a mask of columns, and those leaving the box are lost, so the walls
+    # of the box behave exactly as in sits_in_box( ).
+
+def _row_mask(columns, lx, ly):
+    """ Gives the board with the columns 0, ..., columns - 1 of every row set """
+    row = (1 << columns) - 1
+    return row * (((1 << (lx*ly)) - 1) // ((1 << lx) - 1)) # repeats the row
+
+def _shift_x(board, dx, lx, ly):
+    """ Moves the contents of the board dx columns east (west if dx < 0) """
+    if dx >= 0:
+        return (board & _row_mask(lx - dx, lx, ly)) << dx
+    return (board >> -dx) & _row_mask(lx + dx, lx, ly)
+
+def _shift_y(board, dy, lx, ly):
+    """ Moves the contents of the board dy rows south (north if dy < 0) """
+    if dy >= 0:
+        return (board << (dy*lx)) & ((1 << (lx*ly)) - 1)
+    return board >> (-dy*lx)
+
+def lab2bitboard(lab):
+    """
+    Gives the board of the free cells of the labyrinth, and its dimensions.
+    """
+    if isinstance(lab, (np.ndarray, Labyrinth)):
+        occupancy = lab2array(lab)
+        ly, lx = occupancy.shape
+        packed = np.packbits(~occupancy, bitorder = 'little')
+        return int.from_bytes(packed.tobytes(), 'little'), lx, ly
+    lx, ly = get_shape(lab)
+    cells = ''.join(''.join(row) for row in lab)
+    # the first cell must be the lowest bit
+    return int(cells[::-1].translate(str.maketrans('.#', '10')), 2), lx, ly
+
+def bitboard_masks(free, lx, ly):
+    """
+    Gives the boards hor, ver, rot of the valid horizontal rods, vertical
+    rods and rotation centers (see rod_masks( )), computed from the board of
+    free cells with RADIUS shifts of each kind.
+    """
+    hor = ver = free
+    for d in range(1, RADIUS + 1):
+        hor &= _shift_x(free, d, lx, ly) & _shift_x(free, -d, lx, ly)
+        ver &= _shift_y(free, d, lx, ly) & _shift_y(free, -d, lx, ly)
+    rot = hor # the rows of the box are free, now check all the rows
+    for d in range(1, RADIUS + 1):
+        rot &= _shift_y(hor, d, lx, ly) & _shift_y(hor, -d, lx, ly)
+    return hor, ver, rot
+
+def bitboard_distance(lab, source, target):
+    """
+    Breadth first search with the frontier packed in two bitboards, one per
+    orientation: a whole layer is expanded with a handful of shifts, ANDs
+    and ORs of big integers. Only the distance is computed.
+
+    Inputs:
+        - lab: the list of lists encoding the labyrinth (or its occupancy array)
+        - source: a tuple of 3 integers, a valid configuration of the rod
+        - target: a tuple of 2 integers, the target block
+    Outputs:
+        - distance: the minimal number of moves, -1 if the target is inaccessible
+        - counters: a dictionary with the number of expanded states
+    """
+    free, lx, ly = lab2bitboard(lab)
+    hor, ver, rot = bitboard_masks(free, lx, ly)
+    x, y, o = source
+    tx, ty = target
+
+    goal_hor = goal_ver = 0
+    for d in range(-RADIUS, RADIUS + 1):
+        if point_in_box(tx + d, ty, lx, ly):
+            goal_hor |= 1 << (ty*lx + tx + d)
+        if point_in_box(tx, ty + d, lx, ly):
+            goal_ver |= 1 << ((ty + d)*lx + tx)
+
+    keep = _row_mask(lx - 1, lx, ly) # the columns that do not wrap in a one-cell shift
+
+    def spread(board):
+        # the board shifted by one cell in every direction ('e','w','s','n')
+        return ((board & keep) << 1) | ((board >> 1) & keep) | (board << lx) | (board >> lx)
+
+    front_hor = 0 if o else 1 << (y*lx + x)
+    front_ver = 1 << (y*lx + x) if o else 0
+    seen_hor, seen_ver = front_hor, front_ver
+    distance = 0
+    expanded = 0
+
+    while front_hor or front_ver:
+        if (front_hor & goal_hor) or (front_ver & goal_ver):
+            return distance, {'expanded': expanded}
+        expanded += front_hor.bit_count() + front_ver.bit_count()
+        # the bits leaving the box by the south are cleared by the masks
+        new_hor = (spread(front_hor) | (front_ver & rot)) & hor & ~seen_hor
+        new_ver = (spread(front_ver) | (front_hor & rot)) & ver & ~seen_ver
+        front_hor, front_ver = new_hor, new_ver
+        seen_hor |= front_hor
+        seen_ver |= front_ver
+        distance += 1
+    return -1, {'expanded': expanded}
+
+# LAZY TILED SEARCH
+
+    # For the labyrinths too big to compile, or even to hold in memory, the
+    # search generates the neighbors of a state only when it expands it. The
+    # cells are read from the labyrinth file in square tiles as the search
+    # reaches them: each tile is read with a margin of RADIUS cells around
+    # it, from which the validity masks of the rods centered in the tile are
+    # computed at once, and only the most recently used tiles are kept. The
+    # distances are kept in chunks allocated when the search first enters
+    # them. The memory is thus proportional to the region explored, and
+    # A* (with the bound of rod_heuristic( )) keeps that region small when
+    # the target is near.
+
+class TileStore:
+    """
+    The validity masks of a labyrinth, computed tile by tile on demand.
+
+    Inputs:
+        - source: the path of a labyrinth file (see save_lab( )), or a
+            labyrinth in memory
+        - tile (optional): the side of the tiles, in cells
+        - max_tiles (optional): the number of tiles kept, the least recently
+            used one being dropped beyond
+    """
+
+    def __init__(self, source, tile = 256, max_tiles = 64):
+        if isinstance(source, (str, os.PathLike)):
+            encoding, (lx, ly) = read_lab_header(source)
+            if encoding == BIT_PACKED: # the rows are read packed, a few bytes each
+                self._cells = np.memmap(source, dtype = np.uint8, mode = 'r',
+                                        offset = LAB_HEADER.size, shape = (ly, (lx + 7) // 8))
+            else:
+                self._cells = load_lab(source)
+            self._packed = encoding == BIT_PACKED
+        else:
+            self._cells = lab2array(source)
+            self._packed = False
+            ly, lx = self._cells.shape
+        self.shape = (lx, ly)
+        self.tile = tile
+        self.tiles = LabCache(maxsize = max_tiles)
+
+    def _read(self, x0, y0, x1, y1):
+        # the cells of the rectangle, the ones out of the labyrinth being blocks
+        lx, ly = self.shape
+        block = np.ones((y1 - y0, x1 - x0), dtype = bool)
+        cx0, cy0, cx1, cy1 = max(x0, 0), max(y0, 0), min(x1, lx), min(y1, ly)
+        if self._packed:
+            b0, b1 = cx0 // 8, (cx1 + 7) // 8
+            bits = np.unpackbits(self._cells[cy0:cy1, b0:b1], axis = 1, bitorder = 'little')
+            cells = bits[:, cx0 - 8*b0:cx1 - 8*b0].view(bool)
+        else:
+            cells = self._cells[cy0:cy1, cx0:cx1]
+        block[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0] = cells
+        return block
+
+    def _build(self, i, j):
+        t, r = self.tile, RADIUS
+        block = self._read(j*t - r, i*t - r, (j + 1)*t + r, (i + 1)*t + r)
+        hor, ver, rot = rod_masks(block)
+        return [mask[r:r + t, r:r + t].tolist() for mask in (hor, ver, rot)]
+
+    def masks(self, x, y):
+        """ Gives the masks (hor, ver, rot) of the tile of the cell (x,y), as lists of rows """
+        t = self.tile
+        return self.tiles.get((y // t, x // t), lambda: self._build(y // t, x // t))
+
+    def valid(self, rod):
+        """ Checks whether the rod sits in the labyrinth without collision """
+        x, y, o = rod
+        lx, ly = self.shape
+        if not point_in_box(x, y, lx, ly):
+            return False
+        return self.masks(x, y)[o][y % self.tile][x % self.tile]
+
+    def can_rotate(self, x, y):
+        """ Checks whether a rod centered at (x,y) can rotate """
+        return self.masks(x, y)[2][y % self.tile][x % self.tile]
+
+    def blocked(self, x, y):
+        """ Checks whether the cell (x,y) is a block (or out of the labyrinth) """
+        return bool(self._read(x, y, x + 1, y + 1)[0, 0])
+
+class ChunkedDistances:
+    """
+    The distances of the states reached by a search, stored in square chunks
+    of cells allocated when a state of the chunk is first given a distance.
+    """
+
+    def __init__(self, chunk = 64):
+        self.chunk = chunk
+        self.chunks = {}
+
+    def get(self, rod):
+        """ Gives the distance stored for the rod, -1 if there is none """
+        x, y, o = rod
+        c = self.chunk
+        block = self.chunks.get((y // c, x // c))
+        return -1 if block is None else block[2*((y % c)*c + x % c) + o]
+
+    def set(self, rod, d):
+        x, y, o = rod
+        c = self.chunk
+        key = (y // c, x // c)
+        if key not in self.chunks:
+            self.chunks[key] = [-1]*(2*c*c)
+        self.chunks[key][2*((y % c)*c + x % c) + o] = d
+
+    def __len__(self):
+        """ The number of chunks allocated """
+        return len(self.chunks)
+
+def lazy_distance(lab, source, target, tile = 256, max_tiles = 64):
+    """
+    A* search on the implicit graph of the rod states: the neighbors of a
+    state are generated when it is expanded, from the masks of a TileStore,
+    and the distances are kept in ChunkedDistances.
+
+    Inputs:
+        - lab: a TileStore, or the path of a labyrinth file, or a labyrinth
+            in memory
+        - source: a tuple of 3 integers, a valid configuration of the rod
+        - target: a tuple of 2 integers, the target block
+        - tile, max_tiles (optional): as in TileStore
+    Outputs:
+        - distance: the minimal number of moves, -1 if the target is inaccessible
+        - counters: a dictionary with the number of expanded states, of
+            tiles built and dropped and of chunks of distances allocated
+    """
+    store = lab if isinstance(lab, TileStore) else TileStore(lab, tile, max_tiles)
+    tx, ty = target
+    dist = ChunkedDistances()
+    expanded = 0
+
+    bound = state_bound(tx, ty)
+
+    def counters():
+        info = store.tiles.info()
+        return {'expanded': expanded, 'tiles_built': info['misses'],
+                'tiles_dropped': info['evictions'], 'chunks': len(dist)}
+
+    source = tuple(source)
+    dist.set(source, 0)
+    heap = [(bound(*source), 0, source)]
+    while heap:
+        f, minus_d, rod = heapq.heappop(heap)
+        d = -minus_d
+        if d > dist.get(rod): # a stale entry
+            continue
+        x, y, o = rod
+        if (y == ty and abs(x - tx) <= RADIUS) if o == 0 else (x == tx and abs(y - ty) <= RADIUS):
+            return d, counters()
+        expanded += 1
+        neighbors = [(x + dx, y + dy, o) for s, dx, dy in SHIFTS]
+        if store.can_rotate(x, y):
+            neighbors.append((x, y, 1 - o))
+        for n in neighbors:
+            if store.valid(n):
+                known = dist.get(n)
+                if known < 0 or d + 1 < known:
+                    dist.set(n, d + 1)
+                    heapq.heappush(heap, (d + 1 + bound(*n), -(d + 1), n))
+    return -1, counters()
+
+def lazy_solution(path, source = (1,0,0), target = None, tile = 256, max_tiles = 64,
+                  stats = None):
+    """
+    This function finds the distance as solution( ) does, reading the
+    labyrinth file by tiles as the search reaches them, for the labyrinths
+    too big to compile or to load (see LAZY TILED SEARCH).
+
+    Inputs:
+        - path: the labyrinth file written by save_lab( ) (or a labyrinth in memory)
+        - source, target: as in solution( )
+        - tile, max_tiles (optional): the side of the tiles and the number
+            of tiles kept in memory
+        - stats (optional): a dictionary to which the counters of the search are added
+    Output:
+        - distance: the minimal number of moves, -1 if the target is inaccessible
+    """
+    store = TileStore(path, tile, max_tiles)
+    lx, ly = store.shape
+    if target == None:
+        target = (lx-1,ly-1)
+    if not store.valid(tuple(source)):
+        raise ValueError("The initial configuration of rod collides with the labyrinth.")
+    if store.blocked(*target):
+        print("The target location is blocked by the labyrinth.")
+        return -1
+    distance, counters = lazy_distance(store, source, target)
+    if stats is not None:
+        for key, value in counters.items():
+            stats[key] = stats.get(key, 0) + value
+    return distance
+
+# engines computing the distance only, straight from the labyrinth
+DISTANCE_METHODS = {
+    'bitboard': bitboard_distance,
+    'lazy': lazy_distance,
+}
+
+# INSTRUMENTATION
+
+    # Profiling is opt-in: when solution( ) is given no stats object and no
+    # hook is registered, no clock is read and no counter is recorded. A
+    # profile is a collections.Counter, so profiles are aggregated simply
+    # with Counter.update( ) (or +=), e.g. across the results of a batch.
+    #
+    # Counters of a profile: 'solves', 'compiles' and 'cache_hits' (of the
+    # compiled labyrinths), 'field_lookups' (answers read in a distance
+    # field), 'component_lookups' (answers read in the component index),
+    # 'result_cache_hits' (answers read in the RESULT_CACHE), 'collision_checks'
+    # and 'rotation_checks' (states whose footprint,
+    # resp. rotation box, was checked when building the masks), 'expanded',
+    # 'pushes' and 'pops' (of the search), and the times in seconds
+    # 'time_compile', 'time_search', 'time_output' and 'time_total'.
+
+SOLVE_HOOKS = []
+
+def add_solve_hook(hook):
+    """
+    Registers a function called after every solve as hook(profile, query),
+    with the Counter of the solve and a dictionary of its shape, source,
+    target, method and distance.
+    """
+    SOLVE_HOOKS.append(hook)
+
+def remove_solve_hook(hook):
+    """ Unregisters a function given to add_solve_hook( ) """
+    SOLVE_HOOKS.remove(hook)
+
+# RESULT CACHE
+
+    # The answers can be kept in a file from one run to the next. A query is
+    # stored under a canonical form: the labyrinth, source and target are
+    # mapped by the 8 symmetries of the grid (the transposition, which swaps
+    # the orientation of the rod, and the mirrors in x and y), and the
+    # smallest digest of the 8 images is the key. So a labyrinth and its
+    # mirror images or transposes share their entries. The moves of a
+    # shortest transport are stored in the canonical frame as well, and
+    # mapped back when they are read.
+
+SYMMETRIES = [(t, fx, fy) for t in (0, 1) for fx in (0, 1) for fy in (0, 1)]
+
+def transform_query(occupancy, source, target, symmetry):
+    """
+    Gives the image of the occupancy array, source rod and target block by a
+    symmetry (transpose, flip_x, flip_y), applied in this order.
+    """
+    transpose, flip_x, flip_y = symmetry
+    (x, y, o), (tx, ty) = source, target
+    if transpose:
+        occupancy = occupancy.T
+        x, y, o, tx, ty = y, x, 1 - o, ty, tx
+    ly, lx = occupancy.shape
+    if flip_x:
+        occupancy = occupancy[:, ::-1]
+        x, tx = lx - 1 - x, lx - 1 - tx
+    if flip_y:
+        occupancy = occupancy[::-1, :]
+        y, ty = ly - 1 - y, ly - 1 - ty
+    return occupancy, (x, y, o), (tx, ty)
+
+def transform_moves(moves, symmetry, inverse = False):
+    """ Gives the image of a string of moves by a symmetry, or by its inverse """
+    transpose, flip_x, flip_y = symmetry
+    steps = [str.maketrans('eswn', 'senw')] if transpose else []
+    if flip_x:
+        steps.append(str.maketrans('ew', 'we'))
+    if flip_y:
+        steps.append(str.maketrans('sn', 'ns'))
+    if inverse: # every step is its own inverse
+        steps.reverse()
+    for table in steps:
+        moves = moves.translate(table)
+    return moves
+
+def canonical_query(lab, source, target):
+    """
+    Gives the key of a query in the RESULT_CACHE, and the symmetry mapping
+    the query to its canonical form.
+    """
+    occupancy = lab2array(lab)
+    best = None
+    for symmetry in SYMMETRIES:
+        image, image_source, image_target = transform_query(occupancy, source, target, symmetry)
+        digest = hashlib.blake2b(digest_size = 16)
+        digest.update(struct.pack('<6q', *image.shape, RADIUS, *image_source[:2], image_source[2]))
+        digest.update(struct.pack('<2q', *image_target))
+        digest.update(np.packbits(image).tobytes())
+        key = digest.digest()
+        if best is None or key < best[0]:
+            best = (key, symmetry)
+    return best
+
+class ResultCache:
+    """
+    A persistent cache of the answers of solution( ) (and of the moves of
+    shortest_path( )) in a sqlite file. When it holds more than maxsize
+    answers the least recently used ones are evicted. It counts its hits,
+    misses and evictions, as LabCache does.
+
+    Input:
+        - path (optional): the file of the cache, ':memory:' for a cache
+            which is not kept
+        - maxsize (optional): the maximal number of answers kept
+    """
+
+    def __init__(self, path = 'rod_results.sqlite', maxsize = 1000000):
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("PRAGMA synchronous = NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, "
+                         "distance INTEGER NOT NULL, moves TEXT, used INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self._clock = self._db.execute("SELECT COALESCE(MAX(used), 0) FROM results").fetchone()[0]
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def get(self, lab, source, target, with_moves = False):
+        """
+        Gives the distance stored for the query, or a tuple (distance, moves)
+        with with_moves, None if it is not stored (or has no moves).
+        """
+        key, symmetry = canonical_query(lab, source, target)
+        row = self._db.execute("SELECT distance, moves FROM results WHERE key = ?",
+                               (key,)).fetchone()
+        if row is None or (with_moves and row[1] is None and row[0] >= 0):
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self._db:
+            self._db.execute("UPDATE results SET used = ? WHERE key = ?", (self._tick(), key))
+        distance, moves = row
+        if not with_moves:
+            return distance
+        return distance, (transform_moves(moves, symmetry, inverse = True)
+                          if moves is not None else None)
+
+    def put(self, lab, source, target, distance, moves = None):
+        """ Stores the distance (and the moves) of a query """
+        key, symmetry = canonical_query(lab, source, target)
+        if moves is not None:
+            moves = transform_moves(moves, symmetry)
+        with self._db:
+            self._db.execute("INSERT INTO results VALUES (?, ?, ?, ?) ON CONFLICT (key) "
+                             "DO UPDATE SET distance = excluded.distance, "
+                             "moves = COALESCE(excluded.moves, moves), used = excluded.used",
+                             (key, distance, moves, self._tick()))
+            excess = len(self) - self.maxsize
+            if excess > 0:
+                self._db.execute("DELETE FROM results WHERE key IN (SELECT key FROM "
+                                 "results ORDER BY used LIMIT ?)", (excess,))
+                self.evictions += excess
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def info(self):
+        """ Gives a dictionary with the counters, the hit rate and the size of the cache """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.,
+                'size': len(self), 'maxsize': self.maxsize}
+
+    def clear(self):
+        """ Empties the cache and resets its counters """
+        with self._db:
+            self._db.execute("DELETE FROM results")
+        self.hits = self.misses = self.evictions = 0
+
+    def close(self):
+        self._db.close()
+
+RESULT_CACHE = None
+
+def set_result_cache(cache):
+    """
+    Sets the ResultCache consulted by solution( ) and shortest_path( )
+    (None to stop using one), and gives back the previous one.
+    """
+    global RESULT_CACHE
+    previous, RESULT_CACHE = RESULT_CACHE, cache
+    return previous
+
 # Function that gives the solution to the exercise
 
-def solution(lab, source = (1,0,0), target=None, return_distance_only = True):
+def solution(lab, source = (1,0,0), target=None, return_distance_only = True,
+             method = 'bfs', stats = None, piece = None):
     """
     This function finds the distance in a given labyrinth between a source
-    configuration of the rod and a target block. It implements a slight
-    modification of the Dijkstra algorithm.
+    configuration of the rod and a target block. The search stops at the
+    first configuration in which the rod touches the target block. The
+    configuration graph is compiled once per labyrinth (see compile_lab( )).
 
     Inputs:
         - lab: a list of list of characters, encoding the labyrinth with '.' and '#'
@@ -425,105 +2132,770 @@ def solution(lab, source = (1,0,0), target=None, return_distance_only = True):
             the initial configuration.
         - target: a tuple of 2 integers, the block the rod must touch to solve
             the problem of transport.
+        - method (optional): the search engine, one of the keys of
+            SEARCH_METHODS ('bfs' by default, 'dijkstra', 'astar', 'bidirectional',
+            'dial') or of DISTANCE_METHODS ('bitboard', 'lazy'); the latter do not
+            compile the labyrinth, and 'bfs' is used instead of them for the
+            dictionaries
+        - stats (optional): a dictionary (e.g. a collections.Counter) to which
+            the profile of the solve is added, see INSTRUMENTATION
+        - piece (optional): the Piece moved instead of the rod (see RIGID
+            PIECES), the source being its center and orientation; the
+            distance-only engines are replaced by 'bfs' for it
     Outputs: depending on the value of the flag return_distance_only:
-        - distance: the distance as computed by the Dijkstra algorithm
+        - distance: the minimal number of moves, -1 if the target is inaccessible.
 
-        - dist_dict: a dictionary of distances to the 
-            -1 if the target is inaccessible.
+        - dist_dict: a dictionary of distances to the source, float('inf')
+            for the configurations that were not reached.
         - prev_dict: a dictionary mapping each node to its predecessor in
             the shortest path found
         - access: the specific configuration in which the rod touches the
-            target block. There could be several but by the nature of Dijkstra
-            algorithm the distance found is minimal.
+            target block, None if the target is inaccessible. There could be
+            several but by the nature of the search the distance found is minimal.
+    """
+    if stats is None and not SOLVE_HOOKS:
+        return _cached_solve(lab, source, target, return_distance_only, method, None, piece)
+
+    profile = Counter(solves = 1)
+    start = time.perf_counter()
+    result = _cached_solve(lab, source, target, return_distance_only, method, profile, piece)
+    profile['time_total'] += time.perf_counter() - start
+
+    if stats is not None:
+        for key, value in profile.items():
+            stats[key] = stats.get(key, 0) + value
+    if SOLVE_HOOKS:
+        lx, ly = get_shape(lab)
+        if not isinstance(result, tuple): # the distance, or -1 for a blocked target
+            distance = result
+        else:
+            distance = result[0][result[2]] if result[2] is not None else -1
+        query = {'shape': (lx, ly), 'source': tuple(source), 'method': method,
+                 'target': tuple(target) if target is not None else (lx-1,ly-1),
+                 'distance': distance}
+        for hook in list(SOLVE_HOOKS):
+            hook(profile, query)
+    return result
+
+def _cached_solve(lab, source, target, return_distance_only, method, profile, piece = None):
+    """ Looks the distance up in the RESULT_CACHE before solving, and stores it after """
+    cache = RESULT_CACHE
+    if cache is None or not return_distance_only or piece is not None:
+        return _solve(lab, source, target, return_distance_only, method, profile, piece)
+    if method not in SEARCH_METHODS and method not in DISTANCE_METHODS:
+        raise ValueError(f"Unknown search method {method!r}.")
+    if target == None:
+        lx, ly = get_shape(lab)
+        target = (lx-1,ly-1)
+    distance = cache.get(lab, tuple(source), tuple(target))
+    if distance is not None:
+        if profile is not None:
+            profile['result_cache_hits'] += 1
+        return distance
+    distance = _solve(lab, source, target, return_distance_only, method, profile)
+    cache.put(lab, tuple(source), tuple(target), distance)
+    return distance
+
+def _solve(lab, source, target, return_distance_only, method, profile, piece = None):
+    """
+    The body of solution( ), recording the profile of the solve when
+    profile (a Counter) is not None.
     """
     # Important initializations
 
     lx, ly = get_shape(lab) # size of labyrinth
 
-
-    infinity = 2*lx*ly # upper bound of the amount of states. Only if the
-                        # graph is a chain of nodes connected by one edge will
-                        # the distance approach this value
-
-    infinity = float("inf")
-
     # Workaround for default value of the target depending on size of the lab
 
     if target == None:
         target = (lx-1,ly-1)
     tx, ty = target  # coordinate of target location
 
+    if method not in SEARCH_METHODS and method not in DISTANCE_METHODS:
+        raise ValueError(f"Unknown search method {method!r}.")
+
+    if method in DISTANCE_METHODS:
+        if return_distance_only and piece is None:
+            if rod_collision(source, lab):
+                raise ValueError("The initial configuration of rod collides with the labyrinth.")
+            if point_collision(target[0],target[1],lab):
+                print("The target location is blocked by the labyrinth.")
+                return -1
+            if profile is not None:
+                start = time.perf_counter()
+            distance, counters = DISTANCE_METHODS[method](lab, source, target)
+            if profile is not None:
+                profile['time_search'] += time.perf_counter() - start
+                if method == 'bitboard': # the masks of the whole labyrinth are built
+                    profile['collision_checks'] += 2*lx*ly
+                    profile['rotation_checks'] += lx*ly
+                profile.update(counters)
+            return distance
+        method = 'bfs'
+
+    if profile is not None:
+        start = time.perf_counter()
+        misses = LAB_CACHE.misses
+    graph = compile_lab(lab, piece = piece)
+    if profile is not None:
+        profile['time_compile'] += time.perf_counter() - start
+        if LAB_CACHE.misses > misses:
+            profile['compiles'] += 1
+            profile['collision_checks'] += 2*lx*ly
+            profile['rotation_checks'] += lx*ly
+        else:
+            profile['cache_hits'] += 1
+    s = graph.state_id(source)
+
     # Easy checks for unfeasibility:
 
-    if rod_collision(source, lab):
+    if s < 0:
         raise ValueError("The initial configuration of rod collides with the labyrinth.")
     if point_collision(target[0],target[1],lab):
         print("The target location is blocked by the labyrinth.")
         return -1
 
-    # Initialization of distances and previous_node dictionaries
+    if return_distance_only and graph.components is not None \
+            and not graph.components.can_reach(source, target):
+        if profile is not None:
+            profile['component_lookups'] += 1
+        return -1
 
-    dist_dict = {}
-    prev_dict = {}
-    Q = config_space(lab) # generates all vertices in the graph, i.e.
-                                # possible states of the rod
-    for c in Q:
-        dist_dict[c] = infinity # all nodes are initialized at very big distance
-        prev_dict[c] = None     # no previous knowledge of what node to come from to get                                    # in shortest path to c
+    if return_distance_only and tuple(target) in graph.fields:
+        if profile is not None:
+            profile['field_lookups'] += 1
+        x, y, o = source
+        return int(graph.fields.get(tuple(target), None)[y, x, o])
 
-    dist_dict[source] = 0 # basic initialization
+    if profile is not None:
+        start = time.perf_counter()
+    dist, prev, access, counters = SEARCH_METHODS[method](
+        graph, s, graph.touching_states(tx, ty), target)
+    if profile is not None:
+        profile['time_search'] += time.perf_counter() - start
+        profile.update(counters)
 
-    # main loop of Dijkstra algorithm
+    if return_distance_only:
+        if access < 0: # convention of the challenge for impossible transports
+            return -1
+        return dist[access]
+
+    if profile is not None:
+        start = time.perf_counter()
+    # all the vertices of the graph are listed, as the unvisited ones
+    # are at infinite distance
+    states = [tuple(rod) for rod in graph.states.tolist()]
+    dist_dict = {rod: (d if d >= 0 else float('inf')) for rod, d in zip(states, dist)}
+    prev_dict = {rod: (states[p] if p >= 0 else None) for rod, p in zip(states, prev)}
+    if profile is not None:
+        profile['time_output'] += time.perf_counter() - start
+    return dist_dict, prev_dict, (states[access] if access >= 0 else None)
+
+# SHORTEST PATHS
+
+def move_between(rod, next_rod, orientations = 2):
+    """
+    Gives the move ('e','w','s','n' or 'r', as in allowed_moves( )) taking
+    the rod from one state to the next one; for a piece with more than two
+    orientations, a counterclockwise rotation is 'l'.
+    """
+    x, y, o = rod
+    nx, ny, no = next_rod
+    if no != o:
+        return 'r' if no == (o + 1) % orientations else 'l'
+    for s, dx, dy in SHIFTS:
+        if (nx - x, ny - y) == (dx, dy):
+            return s
+    raise ValueError(f"The rods {rod} and {next_rod} are not one move apart.")
+
+def shortest_path(lab, source = (1,0,0), target = None, method = 'bfs', piece = None):
+    """
+    This function finds a shortest transport of the rod. The path is read
+    backward from the list of predecessors of the search (indexed by state
+    id) and reversed once, in time linear in its length.
 
-    while Q:
+    Inputs:
+        - lab, source, target: as in solution( )
+        - method (optional): one of the keys of SEARCH_METHODS
+        - piece (optional): the Piece moved in the labyrinth, the rod by default
+    Output:
+        - a tuple (states, moves), the list of rod states from the source to
+            a state touching the target and the string of moves between them,
+            or None if the target is inaccessible
+    """
+    cache = RESULT_CACHE if piece is None else None
+    if target == None:
+        lx, ly = get_shape(lab)
+        target = (lx-1,ly-1)
+    if cache is not None:
+        cached = cache.get(lab, tuple(source), tuple(target), with_moves = True)
+        if cached is not None:
+            distance, moves = cached
+            if distance < 0:
+                return None
+            states = [tuple(source)]
+            for move in moves:
+                states.append(rotate_rod(states[-1]) if move == 'r' else shift_rod(states[-1], move))
+            return states, moves
+
+    graph = compile_lab(lab, piece = piece)
+    s = graph.state_id(source)
+    if s < 0:
+        raise ValueError("The initial configuration of rod collides with the labyrinth.")
 
-        # choose u some unvisited node of minimal distance to source
-        qs_with_distances = {q:dist_dict[q] for q in Q}
-        u = min(qs_with_distances, key = qs_with_distances.get)
-        
-        if touches_target(u,tx,ty): # we must have finished since we arrived at target!
-            access = u
-            break # exit while loop
-        Q.remove(u) # delete it from the "unvisited" list
+    dist, prev, access, counters = SEARCH_METHODS[method](
+        graph, s, graph.touching_states(*target), target)
+    if access < 0:
+        if cache is not None:
+            cache.put(lab, tuple(source), tuple(target), -1)
+        return None
+
+    ids = [access]
+    while ids[-1] != s:
+        ids.append(prev[ids[-1]])
+    ids.reverse()
+    states = [tuple(rod) for rod in graph.states[ids].tolist()]
+    moves = ''.join(move_between(a, b, graph.ids.shape[2]) for a, b in zip(states, states[1:]))
+    if cache is not None:
+        cache.put(lab, tuple(source), tuple(target), len(moves), moves)
+    return states, moves
+
+def iter_shortest_path(lab, source = (1,0,0), target = None, piece = None):
+    """
+    This function streams a shortest transport of the rod step by step.
+    Instead of predecessors it reads the distance field of the target (see
+    distance_field( ), a compact integer array kept with the labyrinth):
+    from each state it moves to any neighbor one move closer to the target.
 
-        # explore the neighbors of u and maybe update their distances to source
-        neighbors = allowed_moves(u, lab, give_neighbors = True)
-        for n in neighbors:
-            if n not in Q:
+    Inputs:
+        - lab, source, target: as in solution( )
+        - piece (optional): the Piece moved in the labyrinth, the rod by default
+    Output:
+        - a generator of (move, state), starting with (None, source); it
+            yields nothing if the target is inaccessible
+    """
+    graph = compile_lab(lab, piece = piece)
+    u = graph.state_id(source)
+    if u < 0:
+        raise ValueError("The initial configuration of rod collides with the labyrinth.")
+    field = distance_field(lab, target, piece)
+    x, y, o = source
+    remaining = field[y, x, o]
+    if remaining < 0:
+        return
+    state = tuple(source)
+    yield None, state
+    while remaining > 0:
+        for n in graph.indices[graph.indptr[u]:graph.indptr[u + 1]]:
+            nx, ny, no = graph.states[n].tolist()
+            if field[ny, nx, no] == remaining - 1:
+                break
+        next_state = (nx, ny, no)
+        yield move_between(state, next_state, field.shape[2]), next_state
+        u, state, remaining = n, next_state, remaining - 1
+
+def weighted_solution(lab, source = (1,0,0), target = None, costs = None,
+                      return_moves = False, piece = None):
+    """
+    This function finds the transport of the rod of least total cost, when
+    the moves have different integer costs (e.g. a rotation costing more
+    than a shift), with the bucket queue of dial_search( ).
+
+    Inputs:
+        - lab, source, target: as in solution( )
+        - costs (optional): a dictionary of the integer costs of the moves
+            'e', 'w', 's', 'n' and 'r', 1 for the missing ones
+        - return_moves (optional): whether to give the string of moves as well
+        - piece (optional): the Piece moved in the labyrinth, the rod by default
+    Output:
+        - a tuple (cost, n_moves), the least total cost and the number of
+            moves of the transport (the fewest among those of least cost),
+            (-1, -1) if the target is inaccessible; with return_moves a
+            tuple (cost, moves), moves being None if it is inaccessible
+    """
+    graph = compile_lab(lab, piece = piece)
+    lx, ly = graph.shape
+    if target == None:
+        target = (lx-1,ly-1)
+    s = graph.state_id(source)
+    if s < 0:
+        raise ValueError("The initial configuration of rod collides with the labyrinth.")
+
+    dist, prev, access, counters = dial_search(graph, s, graph.touching_states(*target),
+                                               target, costs)
+    if access < 0:
+        return (-1, None) if return_moves else (-1, -1)
+
+    ids = [access]
+    while ids[-1] != s:
+        ids.append(prev[ids[-1]])
+    if not return_moves:
+        return dist[access], len(ids) - 1
+    ids.reverse()
+    states = [tuple(rod) for rod in graph.states[ids].tolist()]
+    return dist[access], ''.join(move_between(a, b, graph.ids.shape[2])
+                                 for a, b in zip(states, states[1:]))
+
+# COUNTING SHORTEST PATHS
+
+    # The shortest transports form a DAG of the BFS layers: a state at
+    # distance d + 1 is reached from its neighbors at distance d, so the
+    # number of shortest paths to it is the sum of theirs. One pass over
+    # the layers counts them all, with python integers which never overflow,
+    # and a shortest path drawn backward from the goals, each predecessor
+    # with probability proportional to its count, is uniformly distributed.
+
+def _path_counts(graph, source, goals):
+    """
+    Gives the distances, the numbers of shortest paths from the source of
+    the states up to the first layer holding a goal, and the goals in it.
+    """
+    indptr, indices = graph.adjacency()
+    dist = [-1]*len(graph)
+    count = [0]*len(graph)
+    dist[source] = 0
+    count[source] = 1
+    frontier = [source]
+    d = 0
+    while frontier:
+        reached = [u for u in frontier if u in goals]
+        if reached:
+            return dist, count, reached
+        d += 1
+        next_frontier = []
+        for u in frontier:
+            for n in indices[indptr[u]:indptr[u+1]]:
+                if dist[n] < 0:
+                    dist[n] = d
+                    next_frontier.append(n)
+                if dist[n] == d:
+                    count[n] += count[u]
+        frontier = next_frontier
+    return dist, count, []
+
+def _prepare_counts(lab, source, target, piece):
+    graph = compile_lab(lab, piece = piece)
+    lx, ly = graph.shape
+    if target == None:
+        target = (lx-1,ly-1)
+    s = graph.state_id(source)
+    if s < 0:
+        raise ValueError("The initial configuration of rod collides with the labyrinth.")
+    return graph, _path_counts(graph, s, graph.touching_states(*target))
+
+def count_shortest_paths(lab, source = (1,0,0), target = None, piece = None):
+    """
+    This function counts the distinct shortest transports of the rod, in
+    O(V + E) and without enumerating them.
+
+    Inputs:
+        - lab, source, target, piece: as in solution( )
+    Output:
+        - the number of sequences of solution( ) moves taking the rod from
+            the source to a state touching the target, 0 if it is inaccessible
+    """
+    graph, (dist, count, reached) = _prepare_counts(lab, source, target, piece)
+    return sum(count[u] for u in reached)
+
+def sample_shortest_path(lab, source = (1,0,0), target = None, rng = None, piece = None):
+    """
+    This function draws one of the shortest transports of the rod uniformly
+    at random, from the counts of count_shortest_paths( ).
+
+    Inputs:
+        - lab, source, target, piece: as in solution( )
+        - rng (optional): a random.Random, or an integer seed
+    Output:
+        - a tuple (states, moves) as in shortest_path( ), None if the target
+            is inaccessible
+    """
+    if not isinstance(rng, random.Random):
+        rng = random.Random(rng)
+    graph, (dist, count, reached) = _prepare_counts(lab, source, target, piece)
+    if not reached:
+        return None
+    indptr, indices = graph.adjacency()
+
+    def draw(candidates):
+        # the candidate u with probability count[u] / (sum of the counts)
+        ticket = rng.randrange(sum(count[u] for u in candidates))
+        for u in candidates:
+            ticket -= count[u]
+            if ticket < 0:
+                return u
+
+    ids = [draw(reached)]
+    while dist[ids[-1]] > 0:
+        v = ids[-1]
+        ids.append(draw([u for u in indices[indptr[v]:indptr[v+1]]
+                         if dist[u] == dist[v] - 1]))
+    ids.reverse()
+    states = [tuple(rod) for rod in graph.states[ids].tolist()]
+    moves = ''.join(move_between(a, b, graph.ids.shape[2]) for a, b in zip(states, states[1:]))
+    return states, moves
+
+# INCREMENTAL PLANNING
+
+class Planner:
+    """
+    Keeps the solution of one transport problem up to date while obstacles
+    are added to or removed from the labyrinth, with the Lifelong Planning
+    A* algorithm: after a change only the states whose distance is affected
+    are expanded again, instead of solving from scratch.
+
+    The search runs backward, from all the configurations touching the
+    target (at distance 0) toward the source, so that g(state) is the number
+    of moves from state to the target, and it is guided by a consistent
+    lower bound of the moves between a state and the source.
+
+    Inputs:
+        - lab: the list of lists encoding the labyrinth (or its occupancy
+            array). The planner works on its own copy of it.
+        - source, target (optional): as in solution( )
+    """
+
+    def __init__(self, lab, source = (1,0,0), target = None):
+        self.occupancy = lab2array(lab).copy()
+        ly, lx = self.occupancy.shape
+        self.shape = (lx, ly)
+        if target == None:
+            target = (lx-1,ly-1)
+        self.source = tuple(source)
+        self.target = tuple(target)
+        self.expanded = 0 # states expanded so far, across all the updates
+        self._g = {}
+        self._rhs = {}
+        self._queue = [] # heap of (key, state), with stale entries
+        self._keys = {}  # the current key of the states in the queue
+        for state in self._goals():
+            self._update(state)
+
+    # geometry, read from the current occupancy grid
+
+    def _valid(self, state):
+        x, y, o = state
+        lx, ly = self.shape
+        if not sits_in_box(state, lx, ly):
+            return False
+        if o:
+            return not self.occupancy[y - RADIUS:y + RADIUS + 1, x].any()
+        return not self.occupancy[y, x - RADIUS:x + RADIUS + 1].any()
+
+    def _can_rotate(self, x, y):
+        lx, ly = self.shape
+        if not (RADIUS <= x < lx - RADIUS and RADIUS <= y < ly - RADIUS):
+            return False
+        return not self.occupancy[y - RADIUS:y + RADIUS + 1, x - RADIUS:x + RADIUS + 1].any()
+
+    def _candidates(self, state):
+        # the states one move away, whether the moves are allowed or not
+        x, y, o = state
+        return [(x + dx, y + dy, o) for s, dx, dy in SHIFTS] + [(x, y, 1 - o)]
+
+    def _neighbors(self, state):
+        if not self._valid(state):
+            return []
+        x, y, o = state
+        neighbors = [(x + dx, y + dy, o) for s, dx, dy in SHIFTS
+                     if self._valid((x + dx, y + dy, o))]
+        if self._can_rotate(x, y):
+            neighbors.append((x, y, 1 - o))
+        return neighbors
+
+    def _goals(self):
+        tx, ty = self.target
+        return [(tx + d, ty, 0) for d in range(-RADIUS, RADIUS + 1)] + \
+               [(tx, ty + d, 1) for d in range(-RADIUS, RADIUS + 1)]
+
+    # Lifelong Planning A*
+
+    def _key(self, state):
+        x, y, o = state
+        sx, sy, so = self.source
+        m = min(self._g.get(state, float('inf')), self._rhs.get(state, float('inf')))
+        return (m + abs(x - sx) + abs(y - sy) + (o != so), m)
+
+    def _update(self, state):
+        if touches_target(state, *self.target):
+            rhs = 0 if self._valid(state) else float('inf')
+        else:
+            rhs = min([self._g.get(n, float('inf')) + 1 for n in self._neighbors(state)],
+                      default = float('inf'))
+        self._rhs[state] = rhs
+        self._keys.pop(state, None)
+        if self._g.get(state, float('inf')) != rhs:
+            key = self._key(state)
+            self._keys[state] = key
+            heapq.heappush(self._queue, (key, state))
+
+    def _compute(self):
+        source = self.source
+        while self._queue:
+            key, u = self._queue[0]
+            if self._keys.get(u) != key: # stale entry
+                heapq.heappop(self._queue)
                 continue
-            possibly_new_distance = 1 + dist_dict[u]
-            if possibly_new_distance < dist_dict[n]:
-                dist_dict[n] = possibly_new_distance
-                prev_dict[n] = u
-   
-    if return_distance_only:
-        distance = dist_dict[access]
-        if distance == float('inf'): # workaround to check the conventions of the challenge
-            distance = -1
-        return distance
-    else:
-        return dist_dict, prev_dict, access
+            source_consistent = self._g.get(source, float('inf')) == self._rhs.get(source, float('inf'))
+            if key >= self._key(source) and source_consistent:
+                break
+            heapq.heappop(self._queue)
+            del self._keys[u]
+            self.expanded += 1
+            if self._g.get(u, float('inf')) > self._rhs[u]:
+                self._g[u] = self._rhs[u]
+                for n in self._neighbors(u):
+                    self._update(n)
+            else:
+                self._g[u] = float('inf')
+                self._update(u)
+                for n in self._neighbors(u):
+                    self._update(n)
+
+    def _change(self, cells, solid):
+        affected = set()
+        for cx, cy in cells:
+            self.occupancy[cy, cx] = solid
+            # every state covering the cell or rotating over it
+            for x in range(cx - RADIUS, cx + RADIUS + 1):
+                for y in range(cy - RADIUS, cy + RADIUS + 1):
+                    for o in [0, 1]:
+                        affected.add((x, y, o))
+        for state in list(affected):
+            affected.update(self._candidates(state))
+        for state in affected:
+            self._update(state)
+
+    # public interface
+
+    def add_obstacles(self, cells):
+        """ Puts blocks in the cells, a list of (x,y) tuples """
+        self._change(cells, True)
+
+    def remove_obstacles(self, cells):
+        """ Clears the blocks of the cells, a list of (x,y) tuples """
+        self._change(cells, False)
+
+    def distance(self):
+        """
+        Gives the minimal number of moves in the current labyrinth, -1 if
+        the target is inaccessible, as solution( ) would.
+        """
+        if not self._valid(self.source):
+            raise ValueError("The initial configuration of rod collides with the labyrinth.")
+        self._compute()
+        distance = self._g.get(self.source, float('inf'))
+        return -1 if distance == float('inf') else distance
+
+    def path(self):
+        """
+        Gives the list of states of a shortest path from the source to a
+        configuration touching the target, None if the target is inaccessible.
+        """
+        if self.distance() < 0:
+            return None
+        state = self.source
+        trajectory = [state]
+        while self._g[state] > 0:
+            state = min(self._neighbors(state), key = lambda n: self._g.get(n, float('inf')))
+            trajectory.append(state)
+        return trajectory
+
+# BATCH SOLVING
+
+    # Labyrinths are sent to the worker processes bit-packed, which is much
+    # smaller (and faster to pickle) than a list of lists of characters.
+
+BatchResult = namedtuple('BatchResult', ['index', 'distance', 'error'])
+
+def encode_lab(lab):
+    """
+    Gives a compact encoding of the labyrinth: its dimensions and the bytes
+    of its occupancy grid packed one bit per cell.
+    """
+    occupancy = lab2array(lab)
+    ly, lx = occupancy.shape
+    return (lx, ly, np.packbits(occupancy).tobytes())
+
+def decode_lab(code):
+    """ Gives back the occupancy array of a labyrinth from encode_lab( ) """
+    lx, ly, packed = code
+    bits = np.unpackbits(np.frombuffer(packed, dtype = np.uint8), count = lx*ly)
+    return bits.reshape(ly, lx).astype(bool)
 
-def show_me_trajectory(lab, animation = True):
+def _solve_chunk(chunk, source, target, method, profiling = False):
+    """
+    Solves a list of (index, encoded labyrinth) in a worker process,
+    reporting the errors of each item instead of raising them. Gives the
+    results and the aggregated profile of the chunk (None if not profiling).
+    """
+    results = []
+    stats = Counter() if profiling else None
+    for i, code in chunk:
+        try:
+            distance = solution(decode_lab(code), source = source,
+                                target = target, method = method, stats = stats)
+            results.append(BatchResult(i, distance, None))
+        except Exception as error:
+            results.append(BatchResult(i, None, error))
+    return results, stats
+
+def solve_many(labs, source = (1,0,0), target = None, method = 'bfs',
+               workers = None, chunksize = 64, ordered = True, stats = None):
+    """
+    This function solves a collection of labyrinths in a pool of worker
+    processes. The labyrinths are read lazily from the iterable and only a
+    few chunks per worker are in flight at any time, so the collection can
+    be arbitrarily long.
 
-    dist, prev, access  = solution(lab, return_distance_only = False)
+    Inputs:
+        - labs: an iterable of labyrinths (lists of lists or occupancy arrays)
+        - source, target, method (optional): as in solution( )
+        - workers (optional): the number of processes, all the cores by
+            default. With workers = 1 everything runs in this process.
+        - chunksize (optional): the number of labyrinths sent at once to a worker
+        - ordered (optional): whether to yield the results in the order of
+            labs, or as soon as their chunk is completed
+        - stats (optional): a Counter to which the profiles of all the solves
+            are added (see INSTRUMENTATION)
+    Output:
+        - a generator of BatchResult(index, distance, error): the position of
+            the labyrinth in labs, the output of solution( ) and None, or None
+            and the exception raised by solution( ) (e.g. the ValueError
+            of a colliding source), which does not stop the batch
+    """
+    def chunks():
+        chunk = []
+        for i, lab in enumerate(labs):
+            chunk.append((i, encode_lab(lab)))
+            if len(chunk) == chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def collect(output):
+        results, profile = output
+        if stats is not None:
+            stats.update(profile)
+        return results
+
+    profiling = stats is not None
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        for chunk in chunks():
+            yield from collect(_solve_chunk(chunk, source, target, method, profiling))
+        return
 
-    distance = dist[access] # the distance
+    max_pending = 4*workers
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        pending = deque()
+
+        def finished():
+            # the results of the oldest chunk, or of the first chunks to complete
+            if ordered:
+                return collect(pending.popleft().result())
+            done, _ = wait(pending, return_when = FIRST_COMPLETED)
+            results = []
+            for future in done:
+                pending.remove(future)
+                results.extend(collect(future.result()))
+            return results
+
+        for chunk in chunks():
+            pending.append(executor.submit(_solve_chunk, chunk, source, target,
+                                           method, profiling))
+            if len(pending) >= max_pending:
+                yield from finished()
+        while pending:
+            yield from finished()
+
+def solve_batch(labs, source = (1,0,0), target = None):
+    """
+    This function solves many labyrinths of the same shape at once, with a
+    breadth first search run in lock-step on all of them: the frontiers are
+    boolean arrays of shape (N, 2, ly, lx), advanced one layer per iteration
+    with array shifts, so that the python overhead is paid once per layer
+    and not once per labyrinth and state. The labyrinths are dropped from
+    the arrays as soon as their search is over.
 
-    if distance == float('inf'): # if there is no solution, exit the function
+    Inputs:
+        - labs: a sequence of labyrinths of the same shape, or a stacked
+            occupancy array of shape (N, ly, lx)
+        - source, target (optional): as in solution( )
+    Output:
+        - an integer array of shape (N,), the distances of the labyrinths as
+            given by solution( ), -1 for an unreachable or blocked target
+    """
+    if isinstance(labs, np.ndarray) and labs.ndim == 3:
+        occupancy = lab2array(labs)
+    else:
+        occupancy = np.stack([lab2array(lab) for lab in labs])
+    n_labs, ly, lx = occupancy.shape
+    if target == None:
+        target = (lx-1,ly-1)
+    tx, ty = target
+    x, y, o = source
+
+    table = summed_area_table(occupancy)
+    l = 2*RADIUS + 1
+    valid = np.stack([_window_free(table, 1, l), _window_free(table, l, 1)], axis = 1)
+    rot = _window_free(table, l, l)
+
+    if not point_in_box(x, y, lx, ly):
+        raise ValueError("The initial configuration of rod collides with the labyrinths.")
+    colliding = np.nonzero(~valid[:, o, y, x])[0]
+    if colliding.size:
+        raise ValueError("The initial configuration of rod collides with the labyrinths "
+                         f"{colliding.tolist()}.")
+
+    goal = np.zeros((2, ly, lx), dtype = bool) # states touching the target
+    for d in range(-RADIUS, RADIUS + 1):
+        if point_in_box(tx + d, ty, lx, ly):
+            goal[0, ty, tx + d] = True
+        if point_in_box(tx, ty + d, lx, ly):
+            goal[1, ty + d, tx] = True
+
+    distances = np.full(n_labs, -1, dtype = np.int64)
+    active = np.arange(n_labs) # the labyrinths still being searched
+    frontier = np.zeros((n_labs, 2, ly, lx), dtype = bool)
+    frontier[:, o, y, x] = True
+    visited = frontier.copy()
+    d = 0
+
+    while active.size:
+        reached = (frontier & goal).any(axis = (1, 2, 3))
+        distances[active[reached]] = d
+        keep = ~reached & frontier.any(axis = (1, 2, 3))
+        if not keep.all():
+            active, frontier, visited = active[keep], frontier[keep], visited[keep]
+            valid, rot = valid[keep], rot[keep]
+
+        new = np.zeros_like(frontier)
+        new[..., :, 1:] |= frontier[..., :, :-1]  # 'e'
+        new[..., :, :-1] |= frontier[..., :, 1:]  # 'w'
+        new[..., 1:, :] |= frontier[..., :-1, :]  # 's'
+        new[..., :-1, :] |= frontier[..., 1:, :]  # 'n'
+        new[:, 0] |= frontier[:, 1] & rot         # 'r'
+        new[:, 1] |= frontier[:, 0] & rot
+        new &= valid
+        new &= ~visited
+        visited |= new
+        frontier = new
+        d += 1
+    return distances
+
+def show_me_trajectory(lab, animation = True, source = (1,0,0), target = None):
+
+    path = shortest_path(lab, source = source, target = target)
+
+    if path is None: # if there is no solution, exit the function
         print('There is no solution to this labyrinth.')
         return
-
-    source = (1,0,0)
-    trajectory = []
-    # iterate backward in the prev dictionary
-    p = access
-    trajectory = [p] + trajectory
-    while p != source:
-        p = prev[p]
-        trajectory = [p] + trajectory
+    trajectory, moves = path
 
     print(trajectory)
+    print(f"Moves: {moves}")
     if animation:
         print("Printing trajectory of minimal distance:")
         for config in trajectory:
@@ -0,0 +1,501 @@
+"""
+Hierarchical pathfinding (in the manner of HPA*) for the labyrinths which
+are queried many times.
+
+The rod states are grouped in square clusters of cluster x cluster
+centers. The portals of a cluster are its states joined by a move to a
+state of a neighboring cluster, and the distances between the portals of
+a cluster, moving inside it with the moves of allowed_moves( ), are
+computed once. A query then searches the small abstract graph of the
+portals (the distances inside the clusters plus the moves between them),
+and only the clusters of the source and of the target are searched state
+by state. The path is refined cluster by cluster when it is asked for.
+
+With exact = True all the border states are portals and the distances are
+those of solution( ). With exact = False only the middle state of every
+run of border states is kept, which makes the abstract graph much smaller
+but the distances only upper bounds: gap_report( ) measures the gap
+against solution( ) on random queries.
+
+The map keeps the masks of rod_masks( ) rather than a compiled graph, so
+that when obstacles are added or removed only the masks around them and
+the clusters around them (and their neighbors, whose portals may change)
+are computed again, whatever the size of the labyrinth.
+
+    hmap = HierarchicalMap(lab, cluster = 16)
+    hmap.distance((1,0,0), (lx-1,ly-1))
+    hmap.save('lab.hpa.npz')
+"""
+import heapq
+from collections import deque
+
+import numpy as np
+
+import functions
+from functions import *
+
+class HierarchicalMap:
+    """
+    The abstract graph of the portals of a labyrinth.
+
+    Inputs:
+        - lab: the list of lists encoding the labyrinth (or its occupancy array)
+        - cluster (optional): the side of the clusters, in cells
+        - exact (optional): whether all the border states are portals
+    Attributes:
+        - occupancy: the occupancy array of the labyrinth
+        - valid, rot: the masks of rod_masks( ), valid being hor and ver
+            stacked by orientation (an array of shape (2, ly, lx))
+        - clusters: a dictionary mapping the number of every cluster (row by
+            row) to its portals, an integer array (P, 3) of the states
+            (x,y,o), and the matrix (P, P) of the distances between them
+            inside the cluster, -1 when there is no such path
+        - rebuilt: the number of clusters computed since the creation
+        - expanded: the number of portals expanded by the last query
+    """
+
+    def __init__(self, lab, cluster = 16, exact = True, _clusters = None):
+        self.occupancy = np.array(lab2array(lab), dtype = bool)
+        self.cluster = cluster
+        self.exact = exact
+        ly, lx = self.occupancy.shape
+        self.n_clusters = (-(-ly // cluster), -(-lx // cluster)) # rows, columns
+        self.rebuilt = 0
+        self.expanded = 0
+        hor, ver, self.rot = rod_masks(self.occupancy)
+        self.valid = np.stack([hor, ver])
+        self._portal_of = {} # portal state -> (cluster, position in it)
+        self._rows = {} # cluster -> (portal states, distances)
+        if _clusters is not None:
+            self.clusters = _clusters
+        else:
+            self.clusters = {}
+            self._build(range(self.n_clusters[0]*self.n_clusters[1]))
+        self._index(self.clusters)
+
+    def __len__(self):
+        """ The number of portals """
+        return sum(len(portals) for portals, _ in self.clusters.values())
+
+    def _box(self, k):
+        """ Gives the rows y0:y1 and columns x0:x1 of the centers of the cluster k """
+        c = self.cluster
+        ly, lx = self.occupancy.shape
+        cy, cx = divmod(k, self.n_clusters[1])
+        return cy*c, min((cy + 1)*c, ly), cx*c, min((cx + 1)*c, lx)
+
+    def _cluster_of(self, state):
+        return (state[1] // self.cluster)*self.n_clusters[1] + state[0] // self.cluster
+
+    def _is_valid(self, state):
+        x, y, o = state
+        ly, lx = self.occupancy.shape
+        return 0 <= x < lx and 0 <= y < ly and o in (0, 1) and bool(self.valid[o, y, x])
+
+    # PREPROCESSING
+
+    def _crossings(self, cy, cx, dx, dy):
+        """
+        Gives the states (arrays (n, 3)) of the pairs joined by a move from
+        the cluster (cy, cx) to the next one east (dx = 1) or south (dy = 1):
+        all of them in exact mode, the middle one of every run otherwise.
+        """
+        c = self.cluster
+        ly, lx = self.occupancy.shape
+        if dx:
+            x = (cx + 1)*c - 1
+            if x + 1 >= lx:
+                return np.zeros((0, 3), dtype = np.intp), np.zeros((0, 3), dtype = np.intp)
+            along = np.arange(cy*c, min((cy + 1)*c, ly))
+            joined = self.valid[:, along, x] & self.valid[:, along, x + 1] # by orientation
+        else:
+            y = (cy + 1)*c - 1
+            if y + 1 >= ly:
+                return np.zeros((0, 3), dtype = np.intp), np.zeros((0, 3), dtype = np.intp)
+            along = np.arange(cx*c, min((cx + 1)*c, lx))
+            joined = self.valid[:, y, along] & self.valid[:, y + 1, along]
+        if not self.exact:
+            # the middle of every run of consecutive pairs, per orientation
+            padded = np.zeros((2, len(along) + 2), dtype = bool)
+            padded[:, 1:-1] = joined
+            steps = np.diff(padded.astype(np.int8), axis = 1)
+            selected = np.zeros_like(joined)
+            for o in range(2):
+                starts = np.flatnonzero(steps[o] == 1)
+                ends = np.flatnonzero(steps[o] == -1)
+                selected[o, (starts + ends - 1) // 2] = True
+            joined = selected
+        os, positions = np.nonzero(joined)
+        if dx:
+            inner = np.stack([np.full(len(os), x), along[positions], os], axis = -1)
+        else:
+            inner = np.stack([along[positions], np.full(len(os), y), os], axis = -1)
+        return inner, inner + [dx, dy, 0]
+
+    def _portals(self, k):
+        """ Gives the states of the portals of the cluster k, sorted """
+        rows, columns = self.n_clusters
+        cy, cx = divmod(k, columns)
+        portals = [np.zeros((0, 3), dtype = np.intp)]
+        if cx + 1 < columns:
+            portals.append(self._crossings(cy, cx, 1, 0)[0])
+        if cx > 0:
+            portals.append(self._crossings(cy, cx - 1, 1, 0)[1])
+        if cy + 1 < rows:
+            portals.append(self._crossings(cy, cx, 0, 1)[0])
+        if cy > 0:
+            portals.append(self._crossings(cy - 1, cx, 0, 1)[1])
+        return np.unique(np.concatenate(portals), axis = 0)
+
+    def _build(self, keys):
+        """
+        Computes the portals of the clusters and the distances between them,
+        with a breadth first search from all the portals of a cluster at
+        once, on the masks of the cluster only: every state of the cluster
+        holds a bitboard of the portals whose search has reached it (one bit
+        per portal, in words of 64 bits), and a layer is a handful of shifts
+        and ORs of these arrays, as in bitboard_distance( ).
+        """
+        full, empty = np.uint64(2**64 - 1), np.uint64(0)
+        for k in keys:
+            y0, y1, x0, x1 = self._box(k)
+            keep = np.where(self.valid[:, y0:y1, x0:x1], full, empty)[..., None]
+            turn = np.where(self.rot[y0:y1, x0:x1], full, empty)[..., None]
+            portals = self._portals(k)
+            n_portals = len(portals)
+            distances = np.full((n_portals, n_portals), -1, dtype = np.int32)
+            if n_portals:
+                xs, ys, os = portals[:, 0] - x0, portals[:, 1] - y0, portals[:, 2]
+                numbers = np.arange(n_portals)
+                frontier = np.zeros(keep.shape[:3] + (-(-n_portals // 64),), dtype = np.uint64)
+                bit = np.left_shift(np.uint64(1), (numbers % 64).astype(np.uint64))
+                frontier[os, ys, xs, numbers // 64] = bit
+                visited = frontier.copy()
+                distances[numbers, numbers] = 0
+                d = 0
+                while True:
+                    d += 1
+                    spread = np.zeros_like(frontier)
+                    spread[:, :, 1:] |= frontier[:, :, :-1]
+                    spread[:, :, :-1] |= frontier[:, :, 1:]
+                    spread[:, 1:] |= frontier[:, :-1]
+                    spread[:, :-1] |= frontier[:, 1:]
+                    spread[0] |= frontier[1] & turn
+                    spread[1] |= frontier[0] & turn
+                    frontier = spread & keep & ~visited
+                    if not frontier.any():
+                        break
+                    visited |= frontier
+                    # the bits of the sources reaching every portal at this layer
+                    bits = np.unpackbits(frontier[os, ys, xs].view(np.uint8), axis = 1,
+                                         bitorder = 'little')[:, :n_portals]
+                    distances[bits.T.astype(bool)] = d
+            self.clusters[k] = (portals, distances)
+            self.rebuilt += 1
+
+    def _index(self, keys):
+        """ Maps the state of every portal of the clusters to its cluster and position """
+        for k in keys:
+            for state in self._rows.get(k, ([], None))[0]:
+                if self._portal_of.get(state, (None,))[0] == k:
+                    del self._portal_of[state]
+            portals, distances = self.clusters[k]
+            states = [tuple(state) for state in portals.tolist()]
+            for i, state in enumerate(states):
+                self._portal_of[state] = (k, i)
+            self._rows[k] = (states, distances)
+
+    # QUERIES
+
+    def _local_search(self, seeds, k):
+        """ Breadth first search from the seed states, staying in the cluster k """
+        y0, y1, x0, x1 = self._box(k)
+        valid, rot = self.valid, self.rot
+        dist = {u: 0 for u in seeds}
+        prev = {u: None for u in seeds}
+        queue = deque(seeds)
+        while queue:
+            u = queue.popleft()
+            x, y, o = u
+            options = [(x + dx, y + dy, o) for s, dx, dy in SHIFTS
+                       if x0 <= x + dx < x1 and y0 <= y + dy < y1]
+            if rot[y, x]:
+                options.append((x, y, 1 - o))
+            for n in options:
+                if n not in dist and valid[n[2], n[1], n[0]]:
+                    dist[n] = dist[u] + 1
+                    prev[n] = u
+                    queue.append(n)
+        return dist, prev
+
+    def _search(self, source, target):
+        """
+        Gives the distance and what is needed to refine the path: the
+        searches in the clusters of the source and of the goals, the
+        predecessors of the portals and the last portal (None for a path
+        which does not leave the cluster of the source), the distance being
+        -1 if the target is inaccessible. Only the clusters of the source and
+        of the target and the portals reached are looked at.
+        """
+        ly, lx = self.occupancy.shape
+        if target == None:
+            target = (lx-1,ly-1)
+        source = tuple(source)
+        if not self._is_valid(source):
+            raise ValueError("The initial configuration of rod collides with the labyrinth.")
+        if point_collision(target[0], target[1], self.occupancy):
+            print("The target location is blocked by the labyrinth.")
+            return -1, None
+        tx, ty = target
+        r = functions.RADIUS
+        goals = [state for d in range(-r, r + 1) for state in [(tx + d, ty, 0), (tx, ty + d, 1)]
+                 if self._is_valid(state)]
+
+        from_source = self._local_search([source], self._cluster_of(source))
+        best, last = float('inf'), None
+        for g in goals:
+            if g in from_source[0] and from_source[0][g] < best:
+                best, last = from_source[0][g], None
+
+        to_goal = {} # portal -> (distance to the nearest goal of its cluster, search)
+        for k in set(self._cluster_of(g) for g in goals):
+            search = self._local_search([g for g in goals if self._cluster_of(g) == k], k)
+            for u, d in search[0].items():
+                if u in self._portal_of:
+                    to_goal[self._portal_of[u]] = (d, search)
+
+        # A* over the portals, numbered (cluster, position): the bound of
+        # rod_heuristic( ) is consistent in the abstract graph too, since its
+        # edges are lengths of true paths, and it is only computed for the
+        # clusters reached
+        dist = {} # cluster -> the distances of its portals, an array
+        bounds = {} # cluster -> the bounds of its portals, a list
+        prev = {}
+        heap = []
+
+        def distances_of(k):
+            if k not in dist:
+                dist[k] = np.full(len(self._rows[k][0]), np.iinfo(np.int64).max, dtype = np.int64)
+                bounds[k] = heuristic_bounds(self.clusters[k][0], tx, ty).tolist()
+            return dist[k]
+
+        for u, d in from_source[0].items():
+            if u in self._portal_of:
+                k, i = node = self._portal_of[u]
+                distances_of(k)[i] = d
+                prev[node] = None
+                heap.append((d + bounds[k][i], -d, node))
+        heapq.heapify(heap)
+        self.expanded = 0
+        while heap:
+            f, d, node = heapq.heappop(heap)
+            d = -d # the deepest first among the equal estimates
+            if f >= best:
+                break
+            k, i = node
+            if d > dist[k][i]:
+                continue
+            self.expanded += 1
+            if node in to_goal and d + to_goal[node][0] < best:
+                best, last = d + to_goal[node][0], node
+            states, distances = self._rows[k]
+            # the other portals of the cluster, relaxed all at once
+            row = distances[i]
+            reached = d + row
+            known = distances_of(k)
+            better = np.flatnonzero((row > 0) & (reached < known))
+            known[better] = reached[better]
+            for j, e in zip(better.tolist(), reached[better].tolist()):
+                prev[k, j] = node
+                heapq.heappush(heap, (e + bounds[k][j], -e, (k, j)))
+            # and the moves to the portals of the neighboring clusters
+            x, y, o = states[i]
+            for s, dx, dy in SHIFTS:
+                other = self._portal_of.get((x + dx, y + dy, o))
+                if other is not None and other[0] != k:
+                    known = distances_of(other[0])
+                    if d + 1 < known[other[1]]:
+                        known[other[1]] = d + 1
+                        prev[other] = node
+                        heapq.heappush(heap, (d + 1 + bounds[other[0]][other[1]], -d - 1, other))
+
+        if best == float('inf'):
+            return -1, None
+        return best, (source, goals, from_source, to_goal, prev, last)
+
+    def distance(self, source = (1,0,0), target = None):
+        """
+        This function finds the distance as solution( ) does, through the
+        abstract graph (an upper bound of it in approximate mode).
+
+        Inputs:
+            - source, target: as in solution( )
+        Output:
+            - the number of moves, -1 if the target is inaccessible (or if no
+                path through the portals kept is found, in approximate mode)
+        """
+        return self._search(source, target)[0]
+
+    def path(self, source = (1,0,0), target = None):
+        """
+        This function finds a transport of the rod through the abstract
+        graph and refines it: the steps between two portals of a cluster are
+        found by a search in that cluster only.
+
+        Inputs:
+            - source, target: as in solution( )
+        Output:
+            - a tuple (states, moves) as in shortest_path( ), None if the
+                target is inaccessible
+        """
+        best, found = self._search(source, target)
+        if best < 0:
+            return None
+        source, goals, from_source, to_goal, prev, last = found
+
+        def walk(search, u):
+            # the states from u back to the seed of the search
+            steps = [u]
+            while search[1][steps[-1]] is not None:
+                steps.append(search[1][steps[-1]])
+            return steps
+
+        if last is None: # without leaving the cluster of the source
+            g = min((g for g in goals if g in from_source[0]), key = from_source[0].get)
+            states = walk(from_source, g)[::-1]
+        else:
+            chain = [last]
+            while prev[chain[-1]] is not None:
+                chain.append(prev[chain[-1]])
+            chain = [self._rows[k][0][i] for k, i in reversed(chain)]
+            states = walk(from_source, chain[0])[::-1]
+            for a, b in zip(chain, chain[1:]):
+                k = self._cluster_of(a)
+                if self._cluster_of(b) != k: # a move between the clusters
+                    states.append(b)
+                else:
+                    states += walk(self._local_search([a], k), b)[::-1][1:]
+            states += walk(to_goal[last][1], chain[-1])[1:]
+
+        moves = ''.join(move_between(a, b) for a, b in zip(states, states[1:]))
+        return states, moves
+
+    def gap_report(self, samples = 100, seed = None):
+        """
+        Compares the distances of the map with those of solution( ) on
+        random queries, from valid states to free blocks.
+
+        Output:
+            - a dictionary with the number of 'queries', of 'exact' answers
+                and of 'missed' ones (no path found though there is one), and
+                the largest and mean gap (in moves) and ratio of the others
+        """
+        rng = np.random.default_rng(seed)
+        free = np.argwhere(~self.occupancy)
+        report = {'queries': 0, 'exact': 0, 'missed': 0, 'max_gap': 0,
+                  'mean_gap': 0., 'max_ratio': 1.}
+        states = np.argwhere(self.valid) # as (o, y, x)
+        if not len(states) or not len(free):
+            return report
+        gaps = []
+        for _ in range(samples):
+            o, y, x = states[rng.integers(len(states))].tolist()
+            source = (x, y, o)
+            ty, tx = free[rng.integers(len(free))].tolist()
+            expected = solution(self.occupancy, source = source, target = (tx, ty))
+            found = self.distance(source, (tx, ty))
+            report['queries'] += 1
+            if found == expected:
+                report['exact'] += 1
+                gaps.append(0)
+            elif found < 0:
+                report['missed'] += 1
+            else:
+                gaps.append(found - expected)
+                report['max_ratio'] = max(report['max_ratio'], found / max(expected, 1))
+        if gaps:
+            report['max_gap'] = max(gaps)
+            report['mean_gap'] = sum(gaps) / len(gaps)
+        return report
+
+    # UPDATES
+
+    def _update(self, cells, blocked):
+        """
+        Sets the cells (in place, the map owning its occupancy array), then
+        recomputes the masks around them, the clusters whose states may have
+        changed with them and their neighbors, whose portals may have
+        changed: the work does not depend on the size of the labyrinth.
+        """
+        for x, y in cells:
+            self.occupancy[y, x] = blocked
+        ly, lx = self.occupancy.shape
+        rows, columns = self.n_clusters
+        r, c = functions.RADIUS, self.cluster
+        keys = set()
+        for x, y in cells:
+            # the centers within r of the cell, whose boxes are within 2r
+            wy0, wy1 = max(y - 2*r, 0), min(y + 2*r + 1, ly)
+            wx0, wx1 = max(x - 2*r, 0), min(x + 2*r + 1, lx)
+            cy0, cy1 = max(y - r, 0), min(y + r + 1, ly)
+            cx0, cx1 = max(x - r, 0), min(x + r + 1, lx)
+            hor, ver, rot = rod_masks(self.occupancy[wy0:wy1, wx0:wx1])
+            inner = (slice(cy0 - wy0, cy1 - wy0), slice(cx0 - wx0, cx1 - wx0))
+            self.valid[0, cy0:cy1, cx0:cx1] = hor[inner]
+            self.valid[1, cy0:cy1, cx0:cx1] = ver[inner]
+            self.rot[cy0:cy1, cx0:cx1] = rot[inner]
+            for cy in range(cy0 // c, (cy1 - 1) // c + 1):
+                for cx in range(cx0 // c, (cx1 - 1) // c + 1):
+                    for ny, nx in [(cy, cx), (cy - 1, cx), (cy + 1, cx), (cy, cx - 1), (cy, cx + 1)]:
+                        if 0 <= ny < rows and 0 <= nx < columns:
+                            keys.add(ny*columns + nx)
+        self._build(sorted(keys))
+        self._index(keys)
+        return len(keys)
+
+    def add_obstacles(self, list_of_obstacles):
+        """
+        Puts blocks in the labyrinth (as put_obstacles( ) does, but in place)
+        and updates the clusters around them. Gives the number of clusters
+        computed again.
+        """
+        return self._update(list_of_obstacles, True)
+
+    def remove_obstacles(self, list_of_cells):
+        """ Clears cells of the labyrinth and updates the clusters around them """
+        return self._update(list_of_cells, False)
+
+    # FILES
+
+    def save(self, path):
+        """ Writes the map (the labyrinth and the abstract graph) to a .npz file """
+        keys = sorted(self.clusters)
+        portals = [self.clusters[k][0] for k in keys]
+        matrices = [self.clusters[k][1].reshape(-1) for k in keys]
+        ly, lx = self.occupancy.shape
+        np.savez_compressed(path, shape = np.array([lx, ly]),
+                            cells = np.packbits(self.occupancy),
+                            settings = np.array([self.cluster, self.exact, functions.RADIUS]),
+                            keys = np.array(keys, dtype = np.int64),
+                            counts = np.array([len(p) for p in portals], dtype = np.int64),
+                            portals = np.concatenate(portals).astype(np.int64) if portals
+                                      else np.zeros((0, 3), dtype = np.int64),
+                            distances = np.concatenate(matrices).astype(np.int32) if matrices
+                                        else np.zeros(0, dtype = np.int32))
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a map written by save( ), without computing the clusters again """
+        with np.load(path) as data:
+            lx, ly = data['shape'].tolist()
+            cluster, exact, radius = data['settings'].tolist()
+            if radius != functions.RADIUS:
+                raise ValueError(f"The map was made for a rod of radius {radius}.")
+            occupancy = np.unpackbits(data['cells'], count = lx*ly).reshape(ly, lx).astype(bool)
+            clusters = {}
+            p = m = 0
+            for k, n in zip(data['keys'].tolist(), data['counts'].tolist()):
+                clusters[k] = (data['portals'][p:p + n],
+                               data['distances'][m:m + n*n].reshape(n, n))
+                p, m = p + n, m + n*n
+        return cls(occupancy, cluster, bool(exact), _clusters = clusters)
@@ -0,0 +1,226 @@
+"""
+Monte Carlo study of the solvability of random labyrinths.
+
+Random labyrinths of a given size are drawn for every fill ratio, and the
+study records how often the rod can be transported to the target, the
+distribution of the distances and of the number of valid configurations.
+It is a pipeline of three stages working on chunks of labyrinths:
+
+    - the generator draws a chunk of seeded labyrinths at once (an array
+      of shape (N, ly, lx)), see make_chunk( ) and generate_chunks( )
+    - the solver solves the whole chunk in lock-step with solve_batch( )
+      and reduces it to histograms, see solve_chunk( )
+    - the aggregator StudyStats adds the histograms of the chunks up
+
+Only the histograms leave a chunk, so the memory does not grow with the
+number of samples, and the chunks can be generated and solved in worker
+processes from their seeds alone:
+
+    python montecarlo.py --size 9x5 --fills 0,0.1,0.2,0.3 --samples 1000000
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from functions import *
+
+CONFIG_BINS = 20 # bins of the fraction of the configurations which are valid
+CHUNK_CELLS = 2**22 # the cells drawn at once when the chunk size is not given
+
+def make_chunk(lx, ly, fill, size, seed, source = (1,0,0), target = None):
+    """
+    Draws size random labyrinths at once, reproducibly given the seed (an
+    integer or a sequence of integers). The cells of the source rod and the
+    target block are kept free, so that every sample is a valid problem.
+
+    Output:
+        - a boolean array of shape (size, ly, lx), True where there is a block
+    """
+    if target is None:
+        target = (lx-1,ly-1)
+    if not sits_in_box(source, lx, ly): # the cells would wrap around
+        raise ValueError("The initial configuration of rod does not sit in the labyrinth.")
+    occupancy = np.random.default_rng(seed).random((size, ly, lx)) < fill
+    xs, ys = get_xs_ys(source) # all its cells, whatever RADIUS
+    occupancy[:, ys, xs] = False
+    occupancy[:, target[1], target[0]] = False
+    return occupancy
+
+def _chunk_sizes(samples, chunk):
+    for start in range(0, samples, chunk):
+        yield min(chunk, samples - start)
+
+def generate_chunks(lx, ly, fill, samples, chunk = None, seed = 0, source = (1,0,0),
+                    target = None):
+    """
+    Yields the random labyrinths of a study in chunks (see make_chunk( )),
+    samples of them in total. The chunk k is drawn with the seed (*seed, k),
+    so the labyrinths do not depend on the process which draws them: the
+    chunks of the fill ratio number i of run_study( ) are those of the seed
+    (seed, i).
+    """
+    chunk = chunk or default_chunk(lx, ly)
+    seed = list(seed) if isinstance(seed, (tuple, list)) else [seed]
+    for k, size in enumerate(_chunk_sizes(samples, chunk)):
+        yield make_chunk(lx, ly, fill, size, (*seed, k), source, target)
+
+def default_chunk(lx, ly):
+    """ Gives a number of labyrinths per chunk keeping the arrays of a chunk small """
+    return max(1, min(4096, CHUNK_CELLS // (lx*ly)))
+
+def solve_chunk(occupancy, source = (1,0,0), target = None):
+    """
+    Solves a chunk of labyrinths and reduces it to histograms.
+
+    Output:
+        - a dictionary with the number of 'samples' and of 'solvable' ones,
+            the histogram of the 'distances' of the solvable ones (the
+            distance d being counted at index d), the sum of the number of
+            valid configurations 'configs_sum' and the histogram 'configs'
+            of their fraction among the 2*lx*ly configurations, in CONFIG_BINS bins
+    """
+    n_labs, ly, lx = occupancy.shape
+    distances = solve_batch(occupancy, source = source, target = target)
+    solved = distances[distances >= 0]
+
+    hor, ver, rot = rod_masks(occupancy)
+    configs = hor.sum(axis = (1, 2)) + ver.sum(axis = (1, 2))
+    bins = np.minimum(configs * CONFIG_BINS // (2*lx*ly), CONFIG_BINS - 1)
+    return {'samples': n_labs, 'solvable': len(solved),
+            'distances': np.bincount(solved),
+            'configs_sum': int(configs.sum()),
+            'configs': np.bincount(bins, minlength = CONFIG_BINS)}
+
+def _run_task(lx, ly, fill, size, seed, source, target):
+    """ Generates and solves a chunk in a worker process """
+    return fill, solve_chunk(make_chunk(lx, ly, fill, size, seed, source, target),
+                             source, target)
+
+def _add_histograms(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    a = a.copy()
+    a[:len(b)] += b
+    return a
+
+class StudyStats:
+    """
+    The running aggregate of a study: for every fill ratio, the number of
+    samples and of solvable ones and the histograms of solve_chunk( ).
+    """
+
+    def __init__(self):
+        self.fills = {}
+
+    def add(self, fill, partial):
+        """ Adds the output of solve_chunk( ) for a chunk of the given fill """
+        if fill not in self.fills:
+            self.fills[fill] = {'samples': 0, 'solvable': 0, 'configs_sum': 0,
+                                'distances': np.zeros(0, dtype = np.int64),
+                                'configs': np.zeros(CONFIG_BINS, dtype = np.int64)}
+        record = self.fills[fill]
+        for key in ['samples', 'solvable', 'configs_sum']:
+            record[key] += partial[key]
+        for key in ['distances', 'configs']:
+            record[key] = _add_histograms(record[key], partial[key])
+
+    def merge(self, other):
+        """ Adds up the aggregate of another study, e.g. run on another machine """
+        for fill, record in other.fills.items():
+            self.add(fill, record)
+
+    def summary(self):
+        """
+        Gives a list with a dictionary per fill ratio: the number of samples,
+        the rate of solvable ones, the mean, median, 90th percentile and
+        maximum of their distances, and the mean number of valid configurations.
+        """
+        rows = []
+        for fill in sorted(self.fills):
+            record = self.fills[fill]
+            histogram = record['distances']
+            solvable = record['solvable']
+            row = {'fill': fill, 'samples': record['samples'],
+                   'solvable_rate': solvable / record['samples'] if record['samples'] else 0.,
+                   'mean_configs': record['configs_sum'] / record['samples'] if record['samples'] else 0.}
+            if solvable:
+                cumulative = np.cumsum(histogram)
+                row['mean_distance'] = float(np.arange(len(histogram)) @ histogram) / solvable
+                row['median_distance'] = int(np.searchsorted(cumulative, 0.5*solvable))
+                row['p90_distance'] = int(np.searchsorted(cumulative, 0.9*solvable))
+                row['max_distance'] = len(histogram) - 1
+            else:
+                row['mean_distance'] = row['median_distance'] = None
+                row['p90_distance'] = row['max_distance'] = None
+            rows.append(row)
+        return rows
+
+def run_study(lx = 9, ly = 5, fills = (0.0, 0.1, 0.2, 0.3), samples = 10000, chunk = None,
+              seed = 0, workers = None, source = (1,0,0), target = None, stats = None):
+    """
+    Runs the study: samples random labyrinths of size lx x ly for every fill
+    ratio, generated and solved chunk by chunk in a pool of worker processes.
+    At most a few chunks per worker are in flight at any time.
+
+    Inputs:
+        - lx, ly, fills, samples: the size, the fill ratios and the number of
+            labyrinths per fill ratio
+        - chunk (optional): the number of labyrinths per chunk, see default_chunk( )
+        - seed (optional): the seed of the study, the results do not depend
+            on the number of workers
+        - workers (optional): the number of processes, all the cores by
+            default; with workers = 1 everything runs in this process
+        - source, target (optional): as in solution( )
+        - stats (optional): a StudyStats to add the results to
+    Output:
+        - the StudyStats
+    """
+    stats = stats if stats is not None else StudyStats()
+    chunk = chunk or default_chunk(lx, ly)
+    tasks = ((lx, ly, fill, size, (seed, i, k), source, target)
+             for i, fill in enumerate(fills)
+             for k, size in enumerate(_chunk_sizes(samples, chunk)))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        for task in tasks:
+            stats.add(*_run_task(*task))
+        return stats
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        pending = set()
+        for task in tasks:
+            pending.add(executor.submit(_run_task, *task))
+            if len(pending) >= 4*workers:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    stats.add(*future.result())
+        for future in pending:
+            stats.add(*future.result())
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Monte Carlo study of the solvability of random labyrinths.")
+    parser.add_argument('--size', default = '9x5', help = "size of the labyrinths, e.g. 9x5")
+    parser.add_argument('--fills', type = lambda t: [float(f) for f in t.split(',')],
+                        default = [0.0, 0.1, 0.2, 0.3], help = "comma separated fill ratios")
+    parser.add_argument('--samples', type = int, default = 10000,
+                        help = "number of labyrinths per fill ratio")
+    parser.add_argument('--chunk', type = int, default = None)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--workers', type = int, default = None)
+    args = parser.parse_args()
+
+    lx, ly = (int(n) for n in args.size.split('x'))
+    stats = run_study(lx, ly, args.fills, args.samples, args.chunk, args.seed, args.workers)
+    print(f"{'fill':>6} {'samples':>9} {'solvable':>9} {'mean':>7} {'median':>7}"
+          f" {'p90':>5} {'max':>5} {'configs':>8}")
+    for row in stats.summary():
+        numbers = [row[k] if row[k] is not None else '-' for k in
+                   ['median_distance', 'p90_distance', 'max_distance']]
+        mean = f"{row['mean_distance']:7.2f}" if row['mean_distance'] is not None else f"{'-':>7}"
+        print(f"{row['fill']:6.3f} {row['samples']:>9} {row['solvable_rate']:9.3f} {mean}"
+              f" {numbers[0]:>7} {numbers[1]:>5} {numbers[2]:>5} {row['mean_configs']:8.1f}")
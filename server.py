@@ -0,0 +1,369 @@
+"""
+A solve service: an asyncio server answering rod transport queries sent as
+JSON lines over TCP, on localhost by default.
+
+Every line sent by a client is a query, answered by one line:
+
+    {"id": 1, "lab": ["....#....", ...], "source": [1,0,0], "target": [8,4], "method": "bfs"}
+    {"id": 1, "distance": 12}
+
+"source", "target" and "method" are optional, with the defaults of
+solution( ), and the answer is {"id": ..., "error": "..."} when the query
+fails. The line {"id": ..., "op": "metrics"} is answered with the counters
+and latencies of the server.
+
+The searches run in a bounded pool of worker processes, each keeping the
+labyrinths it has compiled in its LAB_CACHE between requests. Identical
+queries arriving while one of them is computed share its result, and when
+too many queries are pending the server stops reading from the
+connections (TCP then pushes back on the clients). A client and a load
+generator are included:
+
+    python server.py serve --port 8765 --workers 4
+    python server.py load --port 8765 --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from functions import *
+
+DEFAULT_PORT = 8765
+LATENCY_WINDOW = 10000 # the latencies of the last requests are kept for the percentiles
+MAX_LINE = 2**25 # the longest line read, 32 MiB: a labyrinth of about 5000 x 5000 cells
+
+def parse_query(query):
+    """
+    Gives the occupancy array, source, target and method of a query, with
+    the defaults of solution( ). Raises a ValueError if the query is malformed.
+    """
+    rows = query.get('lab')
+    if not rows:
+        raise ValueError("The query has no labyrinth.")
+    lab = [list(row) if isinstance(row, str) else row for row in rows]
+    occupancy = lab2array(lab)
+    source = tuple(query.get('source', (1,0,0)))
+    target = query.get('target')
+    target = tuple(target) if target is not None else None
+    method = query.get('method', 'bfs')
+    if len(source) != 3 or (target is not None and len(target) != 2):
+        raise ValueError("The source must have 3 coordinates and the target 2.")
+    if method not in SEARCH_METHODS and method not in DISTANCE_METHODS:
+        raise ValueError(f"Unknown search method {method!r}.")
+    return occupancy, source, target, method
+
+def _serve_query(code, source, target, method):
+    """ Solves a query in a worker process """
+    return solution(decode_lab(code), source = source, target = target, method = method)
+
+class SolveServer:
+    """
+    The solve service.
+
+    Inputs:
+        - host, port (optional): the address to listen on, port 0 picks a free port
+        - workers (optional): the number of worker processes, all the cores by default
+        - max_pending (optional): the number of queries accepted and not yet
+            answered beyond which the server stops reading
+        - limit (optional): the length in bytes of the longest query line,
+            a longer one is answered with an error and the connection closed
+    """
+
+    def __init__(self, host = '127.0.0.1', port = DEFAULT_PORT, workers = None,
+                 max_pending = 256, limit = MAX_LINE):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_pending = max_pending
+        self.limit = limit
+        self.counters = Counter()
+        self.latencies = deque(maxlen = LATENCY_WINDOW)
+        self._inflight = {} # query key -> future of its result
+        self._executor = None
+        self._server = None
+        self._slots = None
+        self._pending = 0
+        self._started = None
+
+    async def start(self):
+        """ Starts the pool and listens; the port chosen is in self.port """
+        self._executor = ProcessPoolExecutor(max_workers = self.workers)
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port,
+                                                  limit = self.limit)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started = time.perf_counter()
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._executor is not None:
+            self._executor.shutdown(wait = True)
+
+    def metrics(self):
+        """
+        Gives a dictionary with the counters of the server: 'requests'
+        received, 'completed' and 'errors' among them, 'computations' sent
+        to the pool and 'coalesced' queries answered by another computation,
+        plus the throughput (completed per second) and the latencies (in
+        seconds) of the last requests.
+        """
+        uptime = time.perf_counter() - self._started if self._started else 0.
+        report = {key: self.counters[key] for key in
+                  ['requests', 'completed', 'errors', 'computations', 'coalesced']}
+        report['in_flight'] = len(self._inflight)
+        report['pending'] = self._pending
+        report['uptime'] = uptime
+        report['throughput'] = report['completed'] / uptime if uptime else 0.
+        report.update(latency_summary(self.latencies))
+        return report
+
+    async def _handle(self, reader, writer):
+        tasks = set()
+        lock = asyncio.Lock() # the answers are written one line at a time
+        try:
+            while True:
+                await self._slots.acquire() # backpressure: no reading while full
+                line = b''
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError): # the line is too long
+                    self.counters['errors'] += 1
+                    answer = {'id': None, 'error': f"ValueError: The query is longer"
+                                                   f" than {self.limit} bytes."}
+                    async with lock:
+                        writer.write((json.dumps(answer) + '\n').encode())
+                        await writer.drain()
+                    break # the rest of the line cannot be told from the next query
+                finally:
+                    if not line: # no query taking the slot
+                        self._slots.release()
+                if not line:
+                    break
+                self._pending += 1
+                task = asyncio.ensure_future(self._answer(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except asyncio.CancelledError: # the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def _answer(self, line, writer, lock):
+        start = time.perf_counter()
+        answer = {}
+        try:
+            query = json.loads(line)
+            answer['id'] = query.get('id')
+            if query.get('op') == 'metrics':
+                answer['metrics'] = self.metrics()
+            else:
+                self.counters['requests'] += 1
+                answer['distance'] = await self._solve(*parse_query(query))
+                self.counters['completed'] += 1
+                self.latencies.append(time.perf_counter() - start)
+        except Exception as error:
+            self.counters['errors'] += 1
+            answer['error'] = f"{type(error).__name__}: {error}"
+        finally:
+            self._pending -= 1
+            self._slots.release()
+        async with lock:
+            writer.write((json.dumps(answer) + '\n').encode())
+            await writer.drain()
+
+    async def _solve(self, occupancy, source, target, method):
+        key = (lab_key(occupancy), source, target, method)
+        if key in self._inflight:
+            self.counters['coalesced'] += 1
+            return await asyncio.shield(self._inflight[key])
+
+        self.counters['computations'] += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, _serve_query,
+                                      encode_lab(occupancy), source, target, method)
+        self._inflight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            del self._inflight[key]
+
+def latency_summary(latencies):
+    """ Gives the mean and the percentiles 50, 90 and 99 of a collection of latencies """
+    if not latencies:
+        return {'latency_mean': None, 'latency_p50': None,
+                'latency_p90': None, 'latency_p99': None}
+    values = np.fromiter(latencies, dtype = float)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]).tolist()
+    return {'latency_mean': float(values.mean()), 'latency_p50': p50,
+            'latency_p90': p90, 'latency_p99': p99}
+
+# CLIENT
+
+class ServerError(Exception):
+    """ The error reported by the server for a query """
+
+class Client:
+    """
+    A client of the solve service. The queries can be sent concurrently on
+    the same connection, the answers being matched to them by their id.
+
+        client = await Client.connect(port = 8765)
+        distance = await client.solve(lab)
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count()
+        self._waiting = {}
+        self._listener = asyncio.ensure_future(self._listen())
+
+    @classmethod
+    async def connect(cls, host = '127.0.0.1', port = DEFAULT_PORT, limit = MAX_LINE):
+        reader, writer = await asyncio.open_connection(host, port, limit = limit)
+        return cls(reader, writer)
+
+    async def _listen(self):
+        try:
+            async for line in self._reader:
+                answer = json.loads(line)
+                if answer.get('id') is None and 'error' in answer:
+                    # a query the server could not read: it closes the connection
+                    for future in self._waiting.values():
+                        if not future.done():
+                            future.set_exception(ServerError(answer['error']))
+                    self._waiting.clear()
+                    continue
+                future = self._waiting.pop(answer.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(answer)
+        finally:
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("The server closed the connection."))
+
+    async def request(self, query):
+        """ Sends a query (a dictionary) and gives the answer of the server """
+        query = dict(query, id = next(self._ids))
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[query['id']] = future
+        self._writer.write((json.dumps(query) + '\n').encode())
+        await self._writer.drain()
+        return await future
+
+    async def solve(self, lab, source = (1,0,0), target = None, method = 'bfs'):
+        """ Gives the distance computed by the server, as solution( ) would """
+        rows = [''.join('#' if cell else '.' for cell in row)
+                for row in lab2array(lab).tolist()]
+        query = {'lab': rows, 'source': list(source), 'method': method}
+        if target is not None:
+            query['target'] = list(target)
+        answer = await self.request(query)
+        if 'error' in answer:
+            raise ServerError(answer['error'])
+        return answer['distance']
+
+    async def metrics(self):
+        """ Gives the metrics of the server """
+        return (await self.request({'op': 'metrics'}))['metrics']
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+        self._listener.cancel()
+
+# LOAD GENERATOR
+
+async def load_test(host = '127.0.0.1', port = DEFAULT_PORT, requests = 1000,
+                    concurrency = 32, lx = 50, ly = 50, fill = 0.05,
+                    distinct = 10, method = 'bfs', seed = 0):
+    """
+    Sends requests queries to the server, at most concurrency of them at a
+    time, about distinct random labyrinths (so that the caches and the
+    coalescing of the server are exercised when distinct is small).
+
+    Output:
+        - a dictionary with the number of requests and errors, the elapsed
+            time, the throughput seen by the client, its latencies, and the
+            metrics reported by the server at the end
+    """
+    from benchmark import benchmark_lab
+    labs = [benchmark_lab(lx, ly, fill, seed + k) for k in range(distinct)]
+    client = await Client.connect(host, port)
+    latencies = []
+    errors = 0
+    queue = iter(range(requests))
+
+    async def user():
+        nonlocal errors
+        for k in queue:
+            start = time.perf_counter()
+            try:
+                await client.solve(labs[k % distinct], method = method)
+            except ServerError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[user() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    report = {'requests': requests, 'errors': errors, 'elapsed': elapsed,
+              'throughput': requests / elapsed}
+    report.update(latency_summary(latencies))
+    report['server'] = await client.metrics()
+    await client.close()
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Solve service of the rod pathfinding problem.")
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    serve = commands.add_parser('serve', help = "run the server")
+    serve.add_argument('--host', default = '127.0.0.1')
+    serve.add_argument('--port', type = int, default = DEFAULT_PORT)
+    serve.add_argument('--workers', type = int, default = None)
+    serve.add_argument('--max-pending', type = int, default = 256)
+    load = commands.add_parser('load', help = "run the load generator against a server")
+    load.add_argument('--host', default = '127.0.0.1')
+    load.add_argument('--port', type = int, default = DEFAULT_PORT)
+    load.add_argument('--requests', type = int, default = 1000)
+    load.add_argument('--concurrency', type = int, default = 32)
+    load.add_argument('--size', default = '50x50', help = "size of the labyrinths, e.g. 50x50")
+    load.add_argument('--fill', type = float, default = 0.05)
+    load.add_argument('--distinct', type = int, default = 10)
+    load.add_argument('--method', default = 'bfs')
+    load.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        async def serve():
+            server = await SolveServer(args.host, args.port, args.workers,
+                                       args.max_pending).start()
+            print(f"Serving on {server.host}:{server.port}")
+            await server.serve_forever()
+        asyncio.run(serve())
+    else:
+        lx, ly = (int(n) for n in args.size.split('x'))
+        report = asyncio.run(load_test(args.host, args.port, args.requests,
+                                       args.concurrency, lx, ly, args.fill,
+                                       args.distinct, args.method, args.seed))
+        server_metrics = report.pop('server')
+        for key, value in report.items():
+            print(f"{key:>12} {value}")
+        print("server:", json.dumps(server_metrics, indent = 1))
@@ -102,3 +102,829 @@ for k in range(3,30):
     assert solution(generate_simple_lab(k)) == 2*(k-2)
     del temp_lab
 
+
+# both search engines agree, and an unreachable target gives -1
+
+lab_walled = str2lab(".........####.####.........####.####.........")
+for k in range(3,12):
+    temp_lab = generate_simple_lab(k)
+    assert solution(temp_lab, method = 'dijkstra') == 2*(k-2)
+assert solution(lab_walled) == -1
+assert solution(lab_walled, method = 'dijkstra') == -1
+
+dist, prev, access = solution(lab_base, return_distance_only = False)
+assert len(dist) == 62
+assert dist[access] == 10
+p = access
+while prev[p] is not None: # the predecessors go back to the source
+    assert dist[prev[p]] == dist[p] - 1
+    p = prev[p]
+assert p == init_rod
+dist, prev, access = solution(lab_walled, return_distance_only = False)
+assert access is None
+
+# the vectorized masks agree with the cell by cell checks
+
+for _ in range(20):
+    gen_lab = random_lab(fill = random.random())
+    hor, ver, rot = rod_masks(gen_lab)
+    for x in range(lx):
+        for y in range(ly):
+            assert hor[y, x] == (not rod_collision((x,y,0), gen_lab))
+            assert ver[y, x] == (not rod_collision((x,y,1), gen_lab))
+            assert rot[y, x] == can_rotate((x,y,0), gen_lab)
+    assert config_space(gen_lab) == [(x,y,o) for x in range(lx) for y in range(ly)
+        for o in [0,1] if not rod_collision((x,y,o), gen_lab)]
+assert lab2array(lab_origin_obs)[0, 0] and not lab2array(lab_origin_obs)[0, 1]
+assert config_space([list("..")], count_states = True)[1] == 0
+
+# the compiled graph agrees with allowed_moves, and is reused from the cache
+
+lab02 = str2lab(".........#...#..#.....#.....#.....#..#.....#.")
+graph = compile_lab(lab02)
+assert [graph.state(i) for i in range(len(graph))] == config_space(lab02)
+for i in range(len(graph)):
+    rod = graph.state(i)
+    assert graph.state_id(rod) == i
+    assert [graph.state(n) for n in graph.indices[graph.indptr[i]:graph.indptr[i+1]]] \
+        == allowed_moves(rod, lab02, give_neighbors = True)
+assert graph.state_id((0,0,0)) == -1 and graph.state_id((-1,0,0)) == -1
+
+LAB_CACHE.clear()
+solution(lab02)
+solution(lab02, source = (2,0,0))
+assert compile_lab(lab02) is compile_lab(put_obstacles(lab02, []))
+assert LAB_CACHE.info()['misses'] == 1 and LAB_CACHE.info()['hits'] == 3
+small_cache = LabCache(maxsize = 2)
+for k in range(3,7):
+    small_cache.get(k, lambda: generate_simple_lab(k))
+small_cache.get(6, lambda: None)
+assert small_cache.info() == {'hits': 1, 'misses': 4, 'evictions': 2, 'size': 2, 'maxsize': 2}
+
+# A* and bidirectional search give the same distances as BFS
+
+for _ in range(200):
+    gen_lab = put_obstacles(random_lab(fill = 0.3*random.random()), [])
+    for i, j in [(0,0),(1,0),(2,0),(8,4)]:
+        gen_lab[j][i] = '.'
+    expected = solution(gen_lab)
+    for method in ['dijkstra', 'astar', 'bidirectional']:
+        assert solution(gen_lab, method = method) == expected
+        result = solution(gen_lab, method = method, return_distance_only = False)
+        if expected == -1:
+            assert result[2] is None
+            continue
+        dist, prev, access = result
+        assert touches_target(access, 8, 4) and dist[access] == expected
+        steps = 0
+        while prev[access] is not None:
+            assert access in allowed_moves(prev[access], gen_lab, give_neighbors = True)
+            access = prev[access]
+            steps += 1
+        assert access == init_rod and steps == expected
+
+stats_bfs, stats_astar = {}, {}
+open_lab = generate_simple_lab(40)
+assert solution(open_lab, stats = stats_bfs) == solution(open_lab, method = 'astar', stats = stats_astar)
+assert stats_astar['expanded'] < stats_bfs['expanded']
+open_graph = compile_lab(open_lab) # the bound of a state is that of rod_heuristic( )
+bound, h = state_bound(30, 17), rod_heuristic(open_graph, 30, 17)
+assert all(bound(*open_graph.state(i)) == h[i] for i in range(0, len(open_graph), 7))
+
+# the distance field answers every source at once
+
+for gen_lab in [lab02, lab_walled] + [random_lab(fill = 0.2) for _ in range(10)]:
+    gen_lab[4][8] = '.'
+    field = distance_field(gen_lab)
+    assert field.shape == (ly, lx, 2)
+    for rod in config_space(gen_lab):
+        x, y, o = rod
+        dist, prev, access = solution(gen_lab, source = rod, return_distance_only = False)
+        assert field[y, x, o] == (dist[access] if access else -1)
+        assert field[y, x, o] == solution(gen_lab, source = rod)
+    assert distance_field(gen_lab) is field
+assert (distance_field(lab_target_obs) == -1).all()
+assert distance_field(lab_base, target = (4,2))[0, 1, 0] == solution(lab_base, target = (4,2), method = 'astar')
+
+# batch solving in worker processes, errors are reported per item
+
+batch = [random_lab(fill = 0.2) for _ in range(30)] + [lab_origin_obs]
+for gen_lab in batch[:-1]:
+    for i, j in [(0,0),(1,0),(2,0),(8,4)]:
+        gen_lab[j][i] = '.'
+assert (decode_lab(encode_lab(lab02)) == lab2array(lab02)).all()
+expected = [solution(gen_lab) for gen_lab in batch[:-1]]
+for workers in [1, 2]:
+    results = list(solve_many(batch, workers = workers, chunksize = 4))
+    assert [r.index for r in results] == list(range(len(batch)))
+    assert [r.distance for r in results[:-1]] == expected
+    assert results[-1].distance is None and isinstance(results[-1].error, ValueError)
+results = solve_many(batch, workers = 2, chunksize = 4, ordered = False)
+assert sorted((r.index, r.distance) for r in results)[:-1] == list(enumerate(expected))
+
+# lock-step search on a batch of labyrinths of the same shape
+
+batch = [random_lab(fill = 0.35*random.random()) for _ in range(300)]
+for gen_lab in batch:
+    for i, j in [(0,0),(1,0),(2,0),(8,4),(4,2)]:
+        gen_lab[j][i] = '.'
+batch += [lab_walled, lab_target_obs, lab02]
+expected = [solution(gen_lab) for gen_lab in batch]
+assert solve_batch(batch).tolist() == expected
+assert solve_batch(np.stack([lab2array(gen_lab) for gen_lab in batch])).tolist() == expected
+assert solve_batch(batch, target = (4,2)).tolist() == [solution(gen_lab, target = (4,2)) for gen_lab in batch]
+try:
+    solve_batch([lab_base, lab_origin_obs])
+    assert False
+except ValueError:
+    pass
+
+# the bitboard engine, with its masks built from shifts of the free cells
+
+for _ in range(50):
+    gen_lab = random_lab(fill = 0.3*random.random())
+    for i, j in [(0,0),(1,0),(2,0),(8,4),(4,1)]:
+        gen_lab[j][i] = '.'
+    free, bx, by = lab2bitboard(gen_lab)
+    assert (bx, by) == (lx, ly)
+    for board, mask in zip(bitboard_masks(free, lx, ly), rod_masks(gen_lab)):
+        assert all(bool(board >> (y*lx + x) & 1) == mask[y, x] for x in range(lx) for y in range(ly))
+    assert lab2bitboard(lab2array(gen_lab))[0] == free
+    assert solution(gen_lab, method = 'bitboard') == solution(gen_lab)
+    assert solution(gen_lab, method = 'bitboard', target = (4,1)) == solution(gen_lab, target = (4,1))
+for k in range(3,30):
+    assert solution(generate_simple_lab(k), method = 'bitboard') == 2*(k-2)
+assert solution(lab_walled, method = 'bitboard') == -1
+
+import functions # a longer rod, RADIUS is read at call time
+functions.RADIUS = 2
+for _ in range(20):
+    gen_lab = [['#' if random.random() < 0.1 else '.' for x in range(15)] for y in range(11)]
+    for i in range(5):
+        gen_lab[0][i] = '.'
+    gen_lab[10][14] = '.'
+    free, bx, by = lab2bitboard(gen_lab)
+    for board, mask in zip(bitboard_masks(free, bx, by), rod_masks(gen_lab)):
+        assert all(bool(board >> (y*bx + x) & 1) == mask[y, x] for x in range(bx) for y in range(by))
+    assert solution(gen_lab, source = (2,0,0), method = 'bitboard') == solution(gen_lab, source = (2,0,0))
+    for i in range(5): # a vertical source
+        gen_lab[i][0] = '.'
+    for method in ['bitboard', 'lazy']:
+        assert solution(gen_lab, source = (0,2,1), method = method) == solution(gen_lab, source = (0,2,1))
+assert get_xs_ys((4,4,0)) == ([2,3,4,5,6], [4]*5) and get_xs_ys((4,4,1)) == ([4]*5, [2,3,4,5,6])
+blocked_lab = put_obstacles(generate_simple_lab(9), [(3,4)]) # under the rod, next to its center
+for method in ['bfs', 'bitboard', 'lazy']:
+    try:
+        solution(blocked_lab, source = (4,4,0), method = method)
+        assert False
+    except ValueError:
+        pass
+functions.RADIUS = 1
+
+# incremental re-planning while the labyrinth changes
+
+for _ in range(10):
+    gen_lab = random_lab(fill = 0.1)
+    for i, j in [(0,0),(1,0),(2,0)]:
+        gen_lab[j][i] = '.'
+    planner = Planner(gen_lab)
+    for step in range(15):
+        cells = [(random.randrange(lx), random.randrange(ly)) for _ in range(2)]
+        cells = [c for c in cells if c not in [(0,0),(1,0),(2,0)]]
+        if random.random() < 0.5:
+            planner.add_obstacles(cells)
+        else:
+            planner.remove_obstacles(cells)
+        current = [['#' if c else '.' for c in row] for row in planner.occupancy.tolist()]
+        if point_collision(8, 4, current):
+            assert planner.distance() == -1
+            continue
+        assert planner.distance() == solution(current)
+        trajectory = planner.path()
+        if trajectory is not None:
+            assert len(trajectory) == planner.distance() + 1
+            assert touches_target(trajectory[-1], 8, 4)
+            for a, b in zip(trajectory, trajectory[1:]):
+                assert b in allowed_moves(a, current, give_neighbors = True)
+
+big_lab = generate_simple_lab(60)
+planner = Planner(big_lab)
+assert planner.distance() == 2*58
+initial = planner.expanded
+planner.add_obstacles([(30, 30), (31, 30)])
+assert planner.distance() == solution(put_obstacles(big_lab, [(30, 30), (31, 30)]))
+assert planner.expanded - initial < initial // 10
+x, y, o = planner.path()[50] # block the way that was found
+planner.add_obstacles([(x, y)])
+assert planner.distance() == solution(put_obstacles(big_lab, [(30, 30), (31, 30), (x, y)]))
+planner.remove_obstacles([(30, 30), (31, 30), (x, y)])
+assert planner.distance() == 2*58
+
+# labyrinth files, text parsing and labyrinths of any size
+
+import contextlib, io, os, tempfile
+assert str2lab("....##", lx = 3) == [list("..."), list(".##")]
+assert get_shape(random_lab(lx = 13, ly = 7)) == (13, 7)
+wide_lab = random_lab(lx = 31, ly = 17, fill = 0.15)
+for i, j in [(0,0),(1,0),(2,0),(30,16)]:
+    wide_lab[j][i] = '.'
+text = "\n".join("".join(row) for row in wide_lab) + "\n"
+assert (read_lab_text(io.BytesIO(text.encode())) == lab2array(wide_lab)).all()
+with tempfile.TemporaryDirectory() as folder:
+    for packed in [False, True]:
+        path = os.path.join(folder, 'wide.lab')
+        save_lab(wide_lab, path, packed = packed)
+        loaded = load_lab(path)
+        assert loaded.shape == (17, 31) and (loaded == lab2array(wide_lab)).all()
+        assert solution(loaded) == solution(wide_lab)
+        assert solution(loaded, method = 'bitboard') == solution(wide_lab)
+        del loaded
+    try:
+        read_lab_header(__file__) # not a labyrinth file
+        assert False
+    except ValueError:
+        pass
+assert put_obstacles(lab2array(lab_base), [(0,0)])[0, 0] and not lab2array(lab_base)[0, 0]
+
+# the benchmark suite runs and compares against a baseline
+
+import benchmark
+assert (random_grid(30, 20, 0.3, seed = 7) == random_grid(30, 20, 0.3, seed = 7)).all()
+results = benchmark.run_suite([(9,5), (20,12)], [0.0, 0.2], ['bfs', 'bitboard'], repeat = 1, verbose = False)
+assert len(results) == 8 and all(r['distance'] == solution(benchmark.benchmark_lab(r['lx'], r['ly'], r['fill'], 0),
+    source = (1,0,0)) for r in results)
+assert benchmark.compare(results, results) == []
+slower = [dict(r, solve_time = 10*r['solve_time'] + 1) for r in results]
+assert len(benchmark.compare(slower, results)) == len(results)
+with tempfile.TemporaryDirectory() as folder:
+    for name in ['results.json', 'results.csv']:
+        benchmark.save_results(results, os.path.join(folder, name))
+        assert benchmark.compare(benchmark.load_results(os.path.join(folder, name)), results) == []
+
+# profiles of the solves, through a stats object or a hook
+
+from collections import Counter
+LAB_CACHE.clear()
+profile = Counter()
+solution(lab02, stats = profile)
+solution(lab02, method = 'astar', stats = profile)
+assert profile['solves'] == 2 and profile['compiles'] == 1 and profile['cache_hits'] == 1
+assert profile['collision_checks'] == 2*lx*ly and profile['rotation_checks'] == lx*ly
+assert profile['pushes'] >= profile['pops'] >= profile['expanded'] > 0
+assert profile['time_total'] >= profile['time_compile'] + profile['time_search'] > 0
+seen = []
+hook = lambda profile, query: seen.append((profile['expanded'], query['distance'], query['method']))
+add_solve_hook(hook)
+distance = solution(lab02, method = 'dijkstra')
+solution(lab02, return_distance_only = False)
+assert solution(put_obstacles(lab02, [(8,4)]), return_distance_only = False) == -1 # blocked target
+remove_solve_hook(hook)
+solution(lab02)
+assert len(seen) == 3 and seen[0][1:] == (distance, 'dijkstra') and seen[1][1] == distance
+assert seen[2][1] == -1
+batch_stats = Counter()
+list(solve_many([lab02, lab_base, lab_origin_obs], workers = 1, stats = batch_stats))
+assert batch_stats['solves'] == 2 # the colliding source raised before finishing its profile
+
+# shortest paths as lists of states and strings of moves
+
+def replay(rod, moves):
+    for move in moves:
+        rod = rotate_rod(rod) if move == 'r' else shift_rod(rod, move)
+        yield rod
+
+for _ in range(50):
+    gen_lab = random_lab(fill = 0.2*random.random())
+    for i, j in [(0,0),(1,0),(2,0)]:
+        gen_lab[j][i] = '.'
+    for target in [(8,4), (5,2)]:
+        expected = solution(gen_lab, target = target) if not point_collision(*target, gen_lab) else -1
+        path = shortest_path(gen_lab, target = target)
+        streamed = list(iter_shortest_path(gen_lab, target = target))
+        if expected == -1:
+            assert path is None and streamed == []
+            continue
+        states, moves = path
+        assert len(states) == len(moves) + 1 == expected + 1
+        assert list(replay(init_rod, moves)) == states[1:]
+        assert touches_target(states[-1], *target)
+        for a, b in zip(states, states[1:]):
+            assert b in allowed_moves(a, gen_lab, give_neighbors = True)
+        assert streamed[0] == (None, init_rod) and len(streamed) == expected + 1
+        stream_moves = ''.join(move for move, state in streamed[1:])
+        assert list(replay(init_rod, stream_moves)) == [state for move, state in streamed[1:]]
+        assert touches_target(streamed[-1][1], *target)
+assert shortest_path(lab_base, source = (7,4,0)) == ([(7,4,0)], '')
+assert shortest_path(lab_base, method = 'astar')[1].count('r') == 0
+
+# the immutable labyrinth answers the geometric questions in constant time
+
+for _ in range(20):
+    gen_lab = random_lab(lx = 12, ly = 7, fill = 0.25)
+    frozen = Labyrinth(gen_lab)
+    assert get_shape(frozen) == (12, 7) and len(frozen) == 7
+    for x in range(-1, 13):
+        for y in range(-1, 8):
+            assert point_collision(x, y, frozen) == point_collision(x, y, gen_lab)
+            for o in [0, 1]:
+                assert rod_collision((x,y,o), frozen) == rod_collision((x,y,o), gen_lab)
+                assert can_rotate((x,y,o), frozen) == can_rotate((x,y,o), gen_lab)
+            if point_in_box(x, y, 12, 7):
+                assert allowed_moves((x,y,0), frozen) == allowed_moves((x,y,0), gen_lab)
+    assert config_space(frozen) == config_space(gen_lab)
+    assert allowed_moves((5,3,0), frozen, give_neighbors = True) == allowed_moves((5,3,0), gen_lab, give_neighbors = True)
+    assert frozen.blocks(0, 0, 12, 7) == sum(row.count('#') for row in gen_lab)
+    if not point_collision(11, 6, gen_lab) and not rod_collision(init_rod, gen_lab):
+        for method in list(SEARCH_METHODS) + list(DISTANCE_METHODS):
+            assert solution(frozen, method = method) == solution(gen_lab, method = method)
+    assert frozen == Labyrinth(lab2array(gen_lab)) and frozen.key == lab_key(gen_lab)
+    assert lab_key(frozen) is frozen.key and compile_lab(frozen) is compile_lab(gen_lab)
+printed = io.StringIO() # the verbose listing names the invalid configurations too
+with contextlib.redirect_stdout(printed):
+    viable = config_space(frozen, verbose = True)
+assert printed.getvalue().count("is viable") == len(viable)
+assert printed.getvalue().count("is not viable") == 2*12*7 - len(viable)
+try:
+    frozen.lx = 3
+    assert False
+except AttributeError:
+    pass
+assert not frozen.grid.flags.writeable
+assert rod_collision((1,0,0), put_obstacles(Labyrinth(lab_base), [(0,0)]))
+
+# the component index agrees with the searches
+
+for _ in range(20):
+    gen_lab = random_lab(lx = 14, ly = 8, fill = 0.3)
+    gen_lab[7][13] = '.'
+    graph = compile_lab(gen_lab)
+    index = component_index(gen_lab)
+    assert index is component_index(gen_lab) and index.sizes.sum() == len(graph)
+    for c in range(len(index)):
+        first = int(np.flatnonzero(index.labels == c)[0])
+        reached = layered_bfs(graph, [first]) >= 0
+        assert np.array_equal(reached, index.labels == c)
+    for rod in graph.states.tolist()[::5]:
+        rod = tuple(rod)
+        expected = distance_field(gen_lab)[rod[1], rod[0], rod[2]]
+        assert solution(gen_lab, source = rod, method = 'astar') == expected
+        assert index.can_reach(rod, (13, 7)) == (expected >= 0)
+        cells = index.reachable_cells(rod)
+        assert cells[rod[1], rod[0]] and not (cells & lab2array(gen_lab)).any()
+        assert index.size(rod) == len(index.reachable_states(rod))
+assert component_index(lab_walled).component((1,0,0)) >= 0
+assert solution(lab_walled) == -1
+assert component_index(lab_walled).size((12,0,0)) == 0
+walled_stats = Counter()
+assert solution(lab_walled, stats = walled_stats) == -1
+assert walled_stats['component_lookups'] == 1 and walled_stats['expanded'] == 0
+
+# the heatmap of the distances to touch every block, in a single search
+
+for _ in range(10):
+    gen_lab = random_lab(lx = 11, ly = 6, fill = 0.25)
+    if rod_collision(init_rod, gen_lab):
+        continue
+    heatmap = touch_distance_map(gen_lab)
+    assert heatmap.shape == (6, 11)
+    for x in range(11):
+        for y in range(6):
+            assert heatmap[y, x] == solution(gen_lab, target = (x, y))
+assert touch_distance_map(lab02, source = (2,0,0))[4, 8] == solution(lab02, source = (2,0,0))
+
+# the solve service answers as solution( ) does, and shares identical queries
+
+import asyncio
+import server
+
+async def check_server():
+    service = await server.SolveServer(port = 0, workers = 1).start()
+    serving = asyncio.ensure_future(service.serve_forever())
+    client = await server.Client.connect(port = service.port)
+    distances = await asyncio.gather(*[client.solve(lab02, source = (2,0,0)) for _ in range(4)],
+                                     client.solve(lab02, source = (2,0,0), method = 'astar'))
+    assert distances == [solution(lab02, source = (2,0,0))]*5
+    try:
+        await client.solve(lab02, source = (1,1,0))
+        assert False
+    except server.ServerError as error:
+        assert 'collides' in str(error)
+    assert 'error' in await client.request({'lab': ['..', '...']})
+    metrics = await client.metrics()
+    assert metrics['requests'] == 7 and metrics['completed'] == 5 and metrics['errors'] == 2
+    assert metrics['computations'] + metrics['coalesced'] == 6
+    report = await server.load_test(port = service.port, requests = 40, concurrency = 8,
+                                    lx = 20, ly = 20, distinct = 2)
+    assert report['errors'] == 0 and report['server']['completed'] == 45
+    await client.close()
+    serving.cancel()
+    await service.close()
+
+asyncio.run(check_server())
+
+async def check_long_lines():
+    # a labyrinth of 300 x 300 cells is a line of about 100 kB
+    service = await server.SolveServer(port = 0, workers = 1, max_pending = 2).start()
+    serving = asyncio.ensure_future(service.serve_forever())
+    big_lab = generate_simple_lab(300)
+    client = await server.Client.connect(port = service.port)
+    assert await client.solve(big_lab) == solution(big_lab)
+    await client.close()
+    serving.cancel()
+    await service.close()
+    # a line too long is answered with an error, and its slot is given back
+    service = await server.SolveServer(port = 0, workers = 1, max_pending = 2, limit = 1000).start()
+    serving = asyncio.ensure_future(service.serve_forever())
+    for _ in range(3):
+        client = await server.Client.connect(port = service.port)
+        try:
+            await client.solve(big_lab)
+            assert False
+        except server.ServerError as error:
+            assert 'longer' in str(error)
+        await client.close()
+    client = await server.Client.connect(port = service.port)
+    assert await client.solve(lab02, source = (2,0,0)) == solution(lab02, source = (2,0,0))
+    assert (await client.metrics())['errors'] == 3
+    await client.close()
+    serving.cancel()
+    await service.close()
+
+asyncio.run(check_long_lines())
+
+# the persistent result cache shares the answers between the symmetric queries
+
+cache_dir = tempfile.TemporaryDirectory()
+cache_path = os.path.join(cache_dir.name, 'results.sqlite')
+result_cache = ResultCache(cache_path)
+set_result_cache(result_cache)
+for _ in range(20):
+    gen_lab = random_lab(lx = 10, ly = 6, fill = 0.15)
+    for i, j in [(0,0),(1,0),(2,0)]:
+        gen_lab[j][i] = '.'
+    occupancy = lab2array(gen_lab)
+    expected = solution(gen_lab)
+    for symmetry in SYMMETRIES:
+        image, image_source, image_target = transform_query(occupancy, (1,0,0), (9,5), symmetry)
+        hits = result_cache.hits
+        assert solution(image, source = image_source, target = image_target) == expected
+        assert result_cache.hits == hits + 1
+        path = shortest_path(image, source = image_source, target = image_target)
+        if expected < 0:
+            assert path is None
+            continue
+        states, moves = path
+        assert len(moves) == expected and states[1:] == list(replay(image_source, moves))
+        assert all(not rod_collision(rod, image) for rod in states)
+        assert touches_target(states[-1], *image_target)
+info = result_cache.info()
+assert info['size'] == 20 and info['evictions'] == 0 and info['hit_rate'] > 0.8
+result_cache.close()
+
+reopened = ResultCache(cache_path, maxsize = 5) # the answers outlive the process
+assert reopened.get(lab02, (2,0,0), (8,4)) is None
+reopened.put(lab02, (2,0,0), (8,4), 11)
+assert reopened.get(lab02, (2,0,0), (8,4)) == 11
+assert len(reopened) == 5 and reopened.evictions == 16
+set_result_cache(reopened)
+assert solution(lab02, source = (2,0,0)) == 11 # read from the cache
+assert set_result_cache(None) is reopened
+reopened.close()
+cache_dir.cleanup()
+
+# weighted moves with the bucket queue agree with the heap
+
+for _ in range(20):
+    gen_lab = random_lab(lx = 12, ly = 7, fill = 0.2)
+    for i, j in [(0,0),(1,0),(2,0)]:
+        gen_lab[j][i] = '.'
+    gen_lab[6][11] = '.'
+    expected = solution(gen_lab)
+    assert solution(gen_lab, method = 'dial') == expected
+    assert weighted_solution(gen_lab) == ((expected, expected) if expected >= 0 else (-1, -1))
+    costs = {'r': random.randint(0, 9), 'e': random.randint(1, 3), 'n': 2}
+    graph = compile_lab(gen_lab)
+    values = move_costs(costs)
+    dist, prev, access, _ = dijkstra_search(graph, graph.state_id((1,0,0)),
+        graph.touching_states(11, 6), cost = lambda u, n: values[
+            graph.moves[graph.indptr[u] + list(graph.indices[graph.indptr[u]:graph.indptr[u+1]]).index(n)]])
+    cost, moves = weighted_solution(gen_lab, costs = costs, return_moves = True)
+    if access < 0:
+        assert (cost, moves) == (-1, None)
+        continue
+    assert cost == dist[access] == sum(values[MOVES.index(m)] for m in moves)
+    assert weighted_solution(gen_lab, costs = costs) == (cost, len(moves))
+    rods = [init_rod] + list(replay(init_rod, moves))
+    assert all(not rod_collision(rod, gen_lab) for rod in rods) and touches_target(rods[-1], 11, 6)
+
+def lexicographic_weighted(lab, costs, target):
+    # the heap on the pairs (cost, moves), encoded as cost*(V + 1) + moves
+    graph = compile_lab(lab)
+    scale = len(graph) + 1
+    values = [c*scale + 1 for c in move_costs(costs)]
+    edge = {(u, n): values[m] for u in range(len(graph))
+            for n, m in zip(graph.indices[graph.indptr[u]:graph.indptr[u+1]].tolist(),
+                            graph.moves[graph.indptr[u]:graph.indptr[u+1]].tolist())}
+    dist, prev, access, _ = dijkstra_search(graph, graph.state_id((1,0,0)),
+        graph.touching_states(*target), cost = lambda u, n: edge[u, n])
+    return divmod(dist[access], scale) if access >= 0 else (-1, -1)
+
+for _ in range(100): # the fewest moves among the transports of least cost, zero costs too
+    gen_lab = random_lab(fill = 0.15)
+    for i, j in [(0,0),(1,0),(2,0),(8,4)]:
+        gen_lab[j][i] = '.'
+    for costs in [{'e': 1, 'w': 2, 's': 2, 'n': 2, 'r': 1},
+                  {move: random.randint(0, 3) for move in 'ewsnr'}]:
+        assert weighted_solution(gen_lab, costs = costs) == lexicographic_weighted(gen_lab, costs, (8,4))
+assert weighted_solution(str2lab(45*'.'), costs = dict.fromkeys('ewsnr', 0)) == (0, 10)
+
+# a wall with a narrow gap: the rod must rotate to pass it, at any cost
+lab_gap = str2lab(27*'.' + '####.####' + 27*'.')
+cost, moves = weighted_solution(lab_gap, return_moves = True)
+assert moves.count('r') == 1 and cost == len(moves) == solution(lab_gap)
+assert weighted_solution(lab_gap, costs = {'r': 50}) == (cost + 49, len(moves))
+try:
+    weighted_solution(lab02, source = (2,0,0), costs = {'x': 1})
+    assert False
+except ValueError:
+    pass
+
+# the Monte Carlo study agrees with solution( ) and does not depend on the workers
+
+import montecarlo
+
+study = montecarlo.run_study(lx = 10, ly = 6, fills = [0.1, 0.25], samples = 300,
+                             chunk = 64, seed = 3, workers = 1)
+for i, fill in enumerate([0.1, 0.25]):
+    distances = []
+    configs = 0
+    for chunk in montecarlo.generate_chunks(10, 6, fill, 300, chunk = 64, seed = (3, i)):
+        for occupancy in chunk:
+            distances.append(solution(occupancy))
+            configs += len(config_space(occupancy))
+    solved = [d for d in distances if d >= 0]
+    record = study.fills[fill]
+    assert record['samples'] == 300 and record['solvable'] == len(solved)
+    assert record['configs_sum'] == configs and record['configs'].sum() == 300
+    assert np.array_equal(record['distances'], np.bincount(solved))
+parallel = montecarlo.run_study(lx = 10, ly = 6, fills = [0.1, 0.25], samples = 300,
+                                chunk = 64, seed = 3, workers = 2)
+assert parallel.summary() == study.summary()
+parallel.merge(study)
+assert [row['samples'] for row in parallel.summary()] == [600, 600]
+assert parallel.summary()[0]['solvable_rate'] == study.summary()[0]['solvable_rate']
+functions.RADIUS = 2 # every cell of the source is kept free, whatever its length
+for source in [(2,0,0), (0,2,1), (4,3,1)]:
+    chunk = montecarlo.make_chunk(9, 7, 0.5, 20, seed = 1, source = source)
+    hor, ver, rot = rod_masks(chunk)
+    assert (ver if source[2] else hor)[:, source[1], source[0]].all()
+    assert all(solution(occupancy, source = source) >= -1 for occupancy in chunk)
+try:
+    montecarlo.make_chunk(9, 7, 0.5, 2, seed = 1, source = (1,0,0))
+    assert False
+except ValueError:
+    pass
+functions.RADIUS = 1
+
+# rigid pieces: the rod as a Piece gives the same graph, and the other pieces
+# agree with a search over their cells and sweep regions checked one by one
+
+for _ in range(10):
+    gen_lab = random_lab(lx = 11, ly = 7, fill = 0.2)
+    plain, as_piece = CompiledLab(gen_lab), CompiledLab(gen_lab, rod_piece())
+    for name in ['states', 'ids', 'indptr', 'indices', 'moves']:
+        assert np.array_equal(getattr(plain, name), getattr(as_piece, name))
+    assert compile_lab(gen_lab, piece = rod_piece()) is compile_lab(gen_lab)
+    assert plain.touching_states(5, 3) == as_piece.touching_states(5, 3)
+    assert rod_heuristic(plain, 5, 3) == rod_heuristic(as_piece, 5, 3)
+    for piece in [None, L_PIECE, T_PIECE]:
+        graph = CompiledLab(gen_lab, piece)
+        bound, h = state_bound(5, 3, piece), rod_heuristic(graph, 5, 3)
+        assert [bound(*graph.state(i)) for i in range(len(graph))] == h
+
+def piece_distance(lab, piece, source, target):
+    occupancy = lab2array(lab)
+    ly, lx = occupancy.shape
+    free = lambda cells: all(point_in_box(x, y, lx, ly) and not occupancy[y, x] for x, y in cells)
+    dist = {source: 0}
+    queue = deque([source])
+    while queue:
+        state = queue.popleft()
+        if touches_target(state, *target, piece = piece):
+            return dist[state]
+        x, y, o = state
+        options = [(x + dx, y + dy, o) for s, dx, dy in SHIFTS]
+        for move, step in piece.turns:
+            if free([(x + dx, y + dy) for dx, dy in piece.sweeps[o, move]]):
+                options.append((x, y, (o + step) % len(piece)))
+        for option in options:
+            if option not in dist and free(piece.cells(option)):
+                dist[option] = dist[state] + 1
+                queue.append(option)
+    return -1
+
+from collections import deque
+long_rod = polyomino(['#####'], name = 'I5')
+assert [len(p) for p in [L_PIECE, T_PIECE, long_rod, polyomino(['##', '##'], (0, 0))]] == [4, 4, 2, 4]
+for piece in [L_PIECE, T_PIECE, long_rod]:
+    for _ in range(15):
+        gen_lab = random_lab(lx = 12, ly = 8, fill = 0.1)
+        source = (2, 2, 0)
+        for x, y in piece.cells(source):
+            gen_lab[y][x] = '.'
+        gen_lab[7][11] = '.'
+        expected = piece_distance(gen_lab, piece, source, (11, 7))
+        for method in SEARCH_METHODS:
+            assert solution(gen_lab, source = source, method = method, piece = piece) == expected
+        assert solution(gen_lab, source = source, method = 'bitboard', piece = piece) == expected
+        path = shortest_path(gen_lab, source = source, piece = piece)
+        streamed = list(iter_shortest_path(gen_lab, source = source, piece = piece))
+        if expected < 0:
+            assert path is None and streamed == []
+            continue
+        states, moves = path
+        assert len(moves) == expected and touches_target(states[-1], 11, 7, piece = piece)
+        assert moves == ''.join(move_between(a, b, len(piece)) for a, b in zip(states, states[1:]))
+        assert len(streamed) == expected + 1 and touches_target(streamed[-1][1], 11, 7, piece)
+        heatmap = touch_distance_map(gen_lab, source = source, piece = piece)
+        assert heatmap[7, 11] == expected
+        assert component_index(gen_lab, piece).can_reach(source, (11, 7))
+
+corner = polyomino(['##', '#.'], (0, 0), name = 'corner') # a sweep given both ways
+narrow = corner.sweeps[0, 'r'][:4]
+assert set(Piece(corner.footprints[0], {(0, 'r'): narrow, (1, 'l'): narrow}).sweeps[1, 'l']) == set(narrow)
+for sweeps in [{(0, 'r'): [(0, 0)]}, {(0, 'r'): narrow, (1, 'l'): narrow + ((1, 1),)}]:
+    try:
+        Piece(corner.footprints[0], sweeps)
+        assert False
+    except ValueError:
+        pass
+
+functions.RADIUS = 2 # the longer rod is the default piece of its radius
+gen_lab = random_lab(lx = 12, ly = 8, fill = 0.1)
+for x in range(5):
+    gen_lab[0][x] = '.'
+gen_lab[7][11] = '.'
+assert solution(gen_lab, source = (2,0,0)) == piece_distance(gen_lab, long_rod, (2,0,0), (11,7))
+assert touches_target((2,0,0), 4, 0) and not touches_target((2,0,0), 5, 0)
+functions.RADIUS = 1
+
+# counting the shortest transports, and drawing one uniformly
+
+def all_shortest_paths(lab, source, target):
+    # enumerates them, depth first along the moves which get one step closer
+    field = distance_field(lab, target)
+    def paths(rod):
+        remaining = field[rod[1], rod[0], rod[2]]
+        if remaining == 0:
+            yield ''
+            return
+        for move, neighbor in zip(allowed_moves(rod, lab), allowed_moves(rod, lab, give_neighbors = True)):
+            x, y, o = neighbor
+            if field[y, x, o] == remaining - 1:
+                for rest in paths(neighbor):
+                    yield move + rest
+    if field[source[1], source[0], source[2]] < 0:
+        return []
+    return list(paths(source))
+
+for _ in range(20):
+    gen_lab = random_lab(lx = 8, ly = 6, fill = 0.15)
+    for i, j in [(0,0),(1,0),(2,0)]:
+        gen_lab[j][i] = '.'
+    gen_lab[5][7] = '.'
+    expected = all_shortest_paths(gen_lab, (1,0,0), (7,5))
+    assert count_shortest_paths(gen_lab) == len(expected)
+    sample = sample_shortest_path(gen_lab, rng = 1)
+    assert (sample is None) == (not expected)
+    if sample:
+        assert sample[1] in expected
+        assert sample[0] == [init_rod] + list(replay(init_rod, sample[1]))
+
+open_lab = generate_simple_lab(4)
+expected = all_shortest_paths(open_lab, (1,0,0), (3,3))
+assert count_shortest_paths(open_lab, target = (3,3)) == len(expected) > 3
+rng = random.Random(7)
+drawn = Counter(sample_shortest_path(open_lab, target = (3,3), rng = rng)[1] for _ in range(4000))
+assert set(drawn) == set(expected)
+assert max(drawn.values()) < 1.5*min(drawn.values()) # about 4000/len(expected) each
+
+big_lab = generate_simple_lab(200) # far too many paths to enumerate, or to fit in 64 bits
+assert count_shortest_paths(big_lab) > 2**64
+assert len(sample_shortest_path(big_lab, rng = 0)[1]) == solution(big_lab)
+
+# 3D voxel labyrinths: the layered search agrees with a search checking the
+# rods one by one, and a volume of one level is a 2D labyrinth
+
+import voxels
+
+def volume_distance(volume, source, target):
+    dist = {source: 0}
+    queue = deque([source])
+    while queue:
+        rod = queue.popleft()
+        if target in voxels.rod_voxels(rod):
+            return dist[rod]
+        x, y, z, o = rod
+        options = []
+        for _, axis, step in voxels.SHIFTS_3D:
+            center = [x, y, z]
+            center[axis] += step
+            options.append((*center, o))
+        options += [(x, y, z, a) for a in range(3) if voxels.can_turn(rod, a, volume)]
+        for option in options:
+            if option not in dist and voxels.rod_fits(option, volume):
+                dist[option] = dist[rod] + 1
+                queue.append(option)
+    return -1
+
+for seed in range(20):
+    volume = voxels.random_volume(6, 5, 4, fill = 0.15, seed = seed)
+    volume[0, 0, :3] = volume[-1, -1, -1] = False
+    assert voxels.solve_volume(volume) == volume_distance(volume, (1,0,0,0), (5,4,3))
+    valid, _ = voxels.volume_masks(volume)
+    states = voxels.volume_config_space(volume)
+    assert len(states) == valid.sum() and all(voxels.rod_fits(rod, volume) for rod in states)
+    occupancy = random_grid(9, 5, 0.2, seed = seed)
+    occupancy[0, :3] = occupancy[4, 8] = False
+    assert voxels.solve_volume(occupancy[None]) == solution(occupancy)
+distance, layers = voxels.solve_volume(np.zeros((5, 5, 5), dtype = bool), return_layers = True)
+assert distance == len(layers) - 1 == 10 and layers[0] == 1
+
+# the lazy search reads the labyrinth files by tiles, and agrees with the
+# compiled searches whatever the tiles kept
+
+with tempfile.TemporaryDirectory() as lazy_dir:
+    for k in range(12):
+        occupancy = random_grid(23, 17, 0.15, seed = k)
+        occupancy[0, :3] = False
+        occupancy[16, 22] = False
+        path = os.path.join(lazy_dir, f'lab{k}.lab')
+        save_lab(occupancy, path, packed = k % 2 == 1)
+        expected = solution(occupancy)
+        assert solution(occupancy, method = 'lazy') == expected
+        lazy_stats = {}
+        assert lazy_solution(path, tile = 4, max_tiles = 3, stats = lazy_stats) == expected
+        assert lazy_stats['tiles_built'] >= 1 and lazy_stats['chunks'] >= 1
+        assert lazy_solution(path, target = (5, 3), tile = 5) == solution(occupancy, target = (5, 3))
+        store = TileStore(path, tile = 6)
+        hor, ver, rot = rod_masks(occupancy)
+        for x, y in [(0, 0), (5, 6), (11, 11), (22, 16), (17, 3)]:
+            assert store.valid((x, y, 0)) == hor[y, x] and store.valid((x, y, 1)) == ver[y, x]
+            assert store.can_rotate(x, y) == rot[y, x] and store.blocked(x, y) == occupancy[y, x]
+        assert not store.valid((23, 0, 0)) and store.blocked(-1, 0)
+        del store # its file is closed before the directory is removed
+near = generate_simple_lab(400) # a target nearby: only the tile around it is read
+near_stats = {}
+assert lazy_solution(near, target = (6, 4), tile = 64, stats = near_stats) == solution(near, target = (6, 4))
+assert near_stats['tiles_built'] == 1
+
+# the hierarchical map agrees with solution( ) in exact mode, gives upper
+# bounds in approximate mode, and keeps agreeing after local updates and
+# once saved and loaded
+
+import hierarchy
+
+with tempfile.TemporaryDirectory() as hpa_dir:
+    for k in range(8):
+        occupancy = random_grid(29, 21, 0.12, seed = k)
+        occupancy[0, :3] = False
+        exact_map = hierarchy.HierarchicalMap(occupancy, cluster = 4 + k % 3)
+        rough_map = hierarchy.HierarchicalMap(occupancy, cluster = 6, exact = False)
+        assert len(rough_map) <= len(exact_map)
+        for target in [None, (14, 10), (3, 17), (28, 0)]:
+            expected = solution(occupancy, target = target)
+            assert exact_map.distance(target = target) == expected
+            assert rough_map.distance(target = target) in ([-1] if expected < 0 else range(expected, 10**6))
+            found = exact_map.path(target = target)
+            if expected < 0:
+                assert found is None
+            else:
+                states, moves = found
+                assert len(moves) == expected and list(replay((1,0,0), moves)) == states[1:]
+                assert all(rod_collision(rod, occupancy.tolist()) == False for rod in states)
+        assert exact_map.gap_report(30, seed = k)['exact'] == 30
+        report = rough_map.gap_report(30, seed = k)
+        assert report['queries'] == 30 and report['max_gap'] >= 0 and report['max_ratio'] >= 1
+
+        # a few blocks: only the clusters around them are computed again
+        rebuilt, cells, snapshot = exact_map.rebuilt, exact_map.occupancy, occupancy.copy()
+        blocks = [(10 + k, 8), (20, 15 - k)]
+        assert exact_map.add_obstacles(blocks) == exact_map.rebuilt - rebuilt
+        assert exact_map.occupancy is cells and cells[8, 10 + k] # set in place, in its own copy
+        assert (occupancy == snapshot).all()
+        assert exact_map.rebuilt - rebuilt < len(exact_map.clusters)
+        fresh = hierarchy.HierarchicalMap(put_obstacles(occupancy, blocks), cluster = exact_map.cluster)
+        assert all((exact_map.clusters[c][0] == fresh.clusters[c][0]).all() and
+                   (exact_map.clusters[c][1] == fresh.clusters[c][1]).all() for c in fresh.clusters)
+        assert (exact_map.valid == fresh.valid).all() and (exact_map.rot == fresh.rot).all()
+        assert exact_map._portal_of == fresh._portal_of # re-indexed cluster by cluster
+        assert exact_map.distance(target = (14, 10)) == solution(put_obstacles(occupancy, blocks), target = (14, 10))
+        exact_map.remove_obstacles(blocks)
+        assert exact_map.distance() == solution(occupancy)
+
+        path = os.path.join(hpa_dir, f'lab{k}.npz')
+        rough_map.save(path)
+        loaded = hierarchy.HierarchicalMap.load(path)
+        assert loaded.rebuilt == 0 and (loaded.occupancy == occupancy).all()
+        assert loaded.distance(target = (14, 10)) == rough_map.distance(target = (14, 10))